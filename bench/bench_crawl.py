@@ -0,0 +1,55 @@
+"""
+Замер обходчиков на локальном сайте bench/fixture_site.py: crawl_in_depth против
+crawl_concurrent. on_page извлекает таблицы страницы и ещё ждёт process_delay секунд
+(как запись xlsx), чтобы было видно, задерживает ли обработка страницы загрузки.
+Проверяется, что оба обходчика посещают одни и те же страницы.
+Использование:
+    python bench/bench_crawl.py [путь_к_скрипту] [потоки] [задержка_обработки]
+"""
+
+import io
+import sys
+import time
+import contextlib
+import fixture_site
+from common import SCRIPT_PATH, load_converter
+
+DEPTHS = (4, 5)
+CONCURRENCY = 8
+PROCESS_DELAY = 0.02
+
+def run(crawl, converter, url, depth, process_delay, **kwargs):
+    """Обход с on_page, как в программе; возвращает посещённые страницы, время и пик запросов"""
+
+    # page (третий аргумент) прежние версии обходчика не передают
+    def on_page(page_url, soup, *page):
+        if soup is not None:
+            converter.get_genuine_tables(converter.get_soup_tables(soup))
+        time.sleep(process_delay)
+
+    fixture_site.reset()
+    start = time.perf_counter()
+    # Печать проверки таблиц и отчётов обходчика не нужна
+    with contextlib.redirect_stdout(io.StringIO()):
+        visited = crawl(url, depth, on_page=on_page, **kwargs)
+    return visited, time.perf_counter() - start, fixture_site.FixtureHandler.in_flight_max
+
+if __name__ == "__main__":
+    converter = load_converter(sys.argv[1] if len(sys.argv) > 1 else SCRIPT_PATH)
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else CONCURRENCY
+    process_delay = float(sys.argv[3]) if len(sys.argv) > 3 else PROCESS_DELAY
+    server = fixture_site.start()
+    url = f"http://127.0.0.1:{server.server_port}/p0"
+    print(f"ответ {fixture_site.DELAY} с, обработка страницы {process_delay} с, потоков {concurrency}")
+    for depth in DEPTHS:
+        serial, serial_time, _ = run(converter.crawl_in_depth, converter, url, depth, process_delay)
+        kwargs = {"concurrency": concurrency}
+        if hasattr(converter, "HostScheduler"):
+            # Замеряется сам обходчик, поэтому вежливость к хосту не ограничивает его
+            kwargs["scheduler"] = converter.HostScheduler(rate=1e6, burst=1e6, max_in_flight=concurrency)
+        concurrent, concurrent_time, in_flight = run(converter.crawl_concurrent, converter, url, depth,
+                                                     process_delay, **kwargs)
+        print(f"глубина {depth}: страниц {len(concurrent)}, crawl_in_depth {serial_time:.2f} с, "
+              f"crawl_concurrent {concurrent_time:.2f} с (одновременно до {in_flight}), "
+              f"посещённые совпадают: {serial == concurrent}")
+    server.shutdown()
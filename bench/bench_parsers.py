@@ -0,0 +1,125 @@
+"""
+Замер парсеров html (PARSERS) на постоянном синтетическом корпусе: страницы со
+списками навигации, текстом и скриптами, среди которых таблицы со случайными
+rowspan/colspan, и одна страница почти без таблиц. Корпус строится с фиксированным
+SEED, поэтому одинаков при каждом запуске.
+Для каждого парсера замеряются разбор всего дерева и разбор только таблиц
+(make_soup с only_tables), время и пик памяти (tracemalloc, отдельным проходом),
+и проверяется, что ячейки и результаты проверки подлинности у всех одинаковы.
+Использование:
+    python bench/bench_parsers.py [путь_к_скрипту] [страниц]
+"""
+
+import io
+import sys
+import time
+import random
+import tracemalloc
+import contextlib
+from bs4 import BeautifulSoup, FeatureNotFound
+from common import SCRIPT_PATH, load_converter
+
+SEED = 5
+PAGES = 40
+BLOCKS = 15
+NAV_LINKS = 50
+PROSE_PARAGRAPHS = 3000
+
+def make_table(rng):
+    """html таблицы 2-6 x 1-6 со случайными rowspan/colspan без наложений"""
+
+    rows_count = rng.randint(2, 6)
+    cols_count = rng.randint(1, 6)
+    occupied = [[False] * cols_count for _ in range(rows_count)]
+    rows = [[] for _ in range(rows_count)]
+    for i in range(rows_count):
+        for j in range(cols_count):
+            if occupied[i][j]:
+                continue
+            rowspan = rng.randint(1, rows_count - i) if rng.random() < 0.3 else 1
+            colspan = 1
+            if rng.random() < 0.3:
+                free = 1
+                while j + free < cols_count and not occupied[i][j + free]:
+                    free += 1
+                colspan = rng.randint(1, free)
+            # Ячейка не должна налезать на занятые ячейки строк ниже
+            for r in range(i + 1, i + rowspan):
+                if any(occupied[r][j:j + colspan]):
+                    rowspan = r - i
+                    break
+            for r in range(i, i + rowspan):
+                for c in range(j, j + colspan):
+                    occupied[r][c] = True
+            spans = (f' rowspan="{rowspan}"' if rowspan > 1 else '') + (f' colspan="{colspan}"' if colspan > 1 else '')
+            rows[i].append(f'<td{spans}>{rng.choice(["x", "<b>x</b>", "<i>y</i>"])}</td>')
+    return "<table>" + "".join("<tr>" + "".join(row) + "</tr>" for row in rows) + "</table>"
+
+def make_corpus(pages=PAGES, seed=SEED):
+    """Страницы корпуса (список str): pages страниц с таблицами и одна страница с текстом"""
+
+    rng = random.Random(seed)
+    nav = '<div class="nav"><ul>' + '<li><a href="/x">link</a></li>' * NAV_LINKS + '</ul></div>'
+    corpus = []
+    for _ in range(pages):
+        body = "".join(nav + "<p>text <b>bold</b></p>" + make_table(rng) for _ in range(BLOCKS))
+        corpus.append("<html><head><script>var a=1;</script></head><body>" + body + "</body></html>")
+    prose = "".join(f"<p>абзац {k} <a href='/p{k}'>ссылка</a></p>" for k in range(PROSE_PARAGRAPHS))
+    corpus.append("<html><body>" + nav + prose + make_table(rng) + "</body></html>")
+    return corpus
+
+def parse(converter, page, parser, only_tables):
+    """Таблицы страницы (элементы bs4)"""
+
+    if hasattr(converter, "make_soup"):
+        soup = converter.make_soup(page, parser, only_tables)
+    else:
+        soup = BeautifulSoup(page, parser)
+    return soup.find_all("table", recursive=True)
+
+def run(converter, corpus, parser, only_tables):
+    """Время разбора корпуса и пик памяти; возвращает также ячейки и вердикты всех таблиц"""
+
+    start = time.perf_counter()
+    for page in corpus:
+        parse(converter, page, parser, only_tables)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for page in corpus:
+        parse(converter, page, parser, only_tables)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    results = []
+    # Печать проверки таблиц не нужна
+    with contextlib.redirect_stdout(io.StringIO()):
+        for page in corpus:
+            for table in parse(converter, page, parser, only_tables):
+                table_span = converter.SpanTable()
+                table_span.make_table(table)
+                results.append((table_span.get_type_of_genuine(),
+                                [(cell.value, cell.rowspan, cell.colspan) for cell in table_span.cells]))
+    return elapsed, peak, results
+
+if __name__ == "__main__":
+    converter = load_converter(sys.argv[1] if len(sys.argv) > 1 else SCRIPT_PATH)
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else PAGES
+    corpus = make_corpus(pages)
+    size = sum(len(page.encode("utf-8")) for page in corpus) / 1e6
+    print(f"страниц {len(corpus)}, {size:.1f} МБ, seed {SEED}")
+    modes = [False, True] if hasattr(converter, "make_soup") else [False]
+    reference = None
+    for parser in getattr(converter, "PARSERS", ("html.parser",)):
+        for only_tables in modes:
+            try:
+                elapsed, peak, results = run(converter, corpus, parser, only_tables)
+            except FeatureNotFound:
+                print(f"{parser}: не установлен")
+                break
+            if reference is None:
+                reference = results
+            mode = "только таблицы" if only_tables else "всё дерево"
+            print(f"{parser}, {mode}: {elapsed:.2f} с ({size / elapsed:.1f} МБ/с), "
+                  f"пик памяти {peak / 1e6:.1f} МБ, таблиц {len(results)}, "
+                  f"результаты совпадают: {results == reference}")
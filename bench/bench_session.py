@@ -0,0 +1,86 @@
+"""
+Замер общей сессии с пулом keep-alive соединений против requests.get
+на локальном сервере HTTP/1.1, а также предела соединений на хост.
+Использование:
+    python bench/bench_session.py [путь_к_скрипту] [число_запросов]
+"""
+
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+from common import SCRIPT_PATH, load_converter
+
+REQUESTS = 1000
+BODY = b"<html><body><table><tr><th>a</th></tr><tr><td>1</td></tr></table></body></html>"
+
+class CountingHandler(BaseHTTPRequestHandler):
+    """Отдаёт одну страницу и считает соединения и одновременные запросы"""
+
+    protocol_version = "HTTP/1.1"
+    # Без этого ответы keep-alive ждут delayed ACK и замер показывает задержки сервера
+    disable_nagle_algorithm = True
+    wbufsize = 65536
+    lock = threading.Lock()
+    connections = 0
+    in_flight = 0
+    in_flight_max = 0
+    delay = 0.0
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            CountingHandler.connections += 1
+
+    def do_GET(self):
+        with self.lock:
+            CountingHandler.in_flight += 1
+            CountingHandler.in_flight_max = max(CountingHandler.in_flight_max, CountingHandler.in_flight)
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+        with self.lock:
+            CountingHandler.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+def reset():
+    CountingHandler.connections = 0
+    CountingHandler.in_flight_max = 0
+
+def run(name, get, url, count):
+    reset()
+    start = time.perf_counter()
+    for _ in range(count):
+        get(url).content
+    print(f"{name}: {time.perf_counter() - start:.2f} с, соединений TCP {CountingHandler.connections}")
+
+if __name__ == "__main__":
+    converter = load_converter(sys.argv[1] if len(sys.argv) > 1 else SCRIPT_PATH)
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else REQUESTS
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+
+    print(f"{count} запросов подряд")
+    run("requests.get", requests.get, url, count)
+    session = converter.make_session()
+    run("сессия", session.get, url, count)
+
+    # 4 * POOL_MAXSIZE потоков к одному хосту: с pool_block соединений не больше POOL_MAXSIZE
+    CountingHandler.delay = 0.02
+    workers = 4 * converter.POOL_MAXSIZE
+    for pool_block in (True, False):
+        reset()
+        session = converter.make_session(pool_block=pool_block)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda _: session.get(url).content, range(workers * 5)))
+        print(f"{workers} потоков, pool_block={pool_block}: соединений TCP {CountingHandler.connections}, "
+              f"одновременных запросов до {CountingHandler.in_flight_max} (POOL_MAXSIZE {converter.POOL_MAXSIZE})")
+    server.shutdown()
@@ -0,0 +1,36 @@
+"""
+Замер vertical_check на широкой таблице: две строки заголовков со смешанными
+rowspan/colspan и 40 строк данных.
+Использование:
+    python bench/bench_vertical_check.py [путь_к_скрипту] [python/numpy]
+"""
+
+import sys
+import time
+from bs4 import BeautifulSoup
+from common import SCRIPT_PATH, load_converter
+
+COLUMNS = (100, 300, 600)
+BODY_ROWS = 40
+REPEAT = 3
+
+def make_wide_table(cols, body_rows=BODY_ROWS):
+    """html широкой таблицы с cols группами заголовков"""
+
+    head = "<tr>" + "".join(f'<th rowspan="2">h{j}</th>' if j % 2 else f'<th colspan="2">g{j}</th>'
+                            for j in range(cols)) + "</tr>"
+    sub = "<tr>" + "<th>a</th><th>b</th>" * len(range(0, cols, 2)) + "</tr>"
+    row = "<tr>" + "".join("<td>1</td>" * (2 if j % 2 == 0 else 1) for j in range(cols)) + "</tr>"
+    return "<table>" + head + sub + row * body_rows + "</table>"
+
+if __name__ == "__main__":
+    converter = load_converter(sys.argv[1] if len(sys.argv) > 1 else SCRIPT_PATH)
+    engine = sys.argv[2] if len(sys.argv) > 2 else "python"
+    for cols in COLUMNS:
+        table = BeautifulSoup(make_wide_table(cols), "html.parser").table
+        table_span = converter.SpanTable(engine)
+        table_span.make_table(table)
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            result = table_span.is_top()
+        print(f"столбцов {cols}: is_top {result}, {(time.perf_counter() - start) / REPEAT:.3f} с")
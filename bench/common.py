@@ -0,0 +1,19 @@
+"""Общее для замеров: загрузка convert_html_to_excel_v_3.1.py как модуля"""
+
+import os
+import importlib.util
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "convert_html_to_excel_v_3.1.py")
+
+def load_converter(path=SCRIPT_PATH):
+    """
+    Модуль программы по пути к файлу (имя файла с точками не импортируется обычным import).
+    Другой путь позволяет сравнить с прежней версией, например
+    git show <коммит>:convert_html_to_excel_v_3.1.py > old.py
+    """
+
+    spec = importlib.util.spec_from_file_location("converter", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
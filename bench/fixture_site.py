@@ -0,0 +1,92 @@
+"""
+Локальный сайт для проверки обходчиков: страницы /p0, /p1, ... образуют троичное дерево
+(страница n ссылается на 3n+1, 3n+2, 3n+3), на каждой таблица, ссылка на главную,
+ссылки с query и фрагментом и внешняя ссылка. Каждый ответ задерживается на delay секунд.
+Использование:
+    python bench/fixture_site.py [порт] [задержка] [страниц]
+"""
+
+import sys
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DELAY = 0.05
+PAGES = 200
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Страницы сайта; hits - сколько раз запрошен каждый путь, in_flight_max - пик одновременных запросов"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    wbufsize = 65536
+    delay = DELAY
+    pages = PAGES
+    lock = threading.Lock()
+    hits = {}
+    in_flight = 0
+    in_flight_max = 0
+
+    def do_GET(self):
+        with self.lock:
+            self.hits[self.path] = self.hits.get(self.path, 0) + 1
+            FixtureHandler.in_flight += 1
+            FixtureHandler.in_flight_max = max(FixtureHandler.in_flight_max, FixtureHandler.in_flight)
+        try:
+            time.sleep(self.delay)
+            self.send_page()
+        finally:
+            with self.lock:
+                FixtureHandler.in_flight -= 1
+
+    def send_page(self):
+        number = self.path.split("?")[0].lstrip("/p")
+        if not number.isdigit() and number != "":
+            number = None
+        number = int(number or 0) if number is not None else None
+        if number is None or number >= self.pages:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        links = "".join(f'<a href="/p{k}?q=1#f">{k}</a>' for k in range(3 * number + 1, 3 * number + 4))
+        links += '<a href="http://other.example/">внешняя</a><a href="/p0">главная</a>'
+        table = f"<table><tr><th>страница</th><th>ссылок</th></tr><tr><td>{number}</td><td>3</td></tr></table>"
+        body = f"<html><body>{table}{links}</body></html>".encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def reset():
+    """Обнулить счётчики запросов"""
+
+    with FixtureHandler.lock:
+        FixtureHandler.hits.clear()
+        FixtureHandler.in_flight_max = 0
+
+def start(port=0, delay=DELAY, pages=PAGES):
+    """Запустить сайт в фоновом потоке, возвращает сервер (адрес - server.server_port)"""
+
+    FixtureHandler.delay = delay
+    FixtureHandler.pages = pages
+    server = ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else DELAY
+    pages = int(sys.argv[3]) if len(sys.argv) > 3 else PAGES
+    server = start(port, delay, pages)
+    print(f"http://127.0.0.1:{server.server_port}/p0, Ctrl+C - остановить")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,165 +1,410 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
+import re
+import html
+import mmap
+import codecs
+import fnmatch
+import asyncio
+import time
+import random
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
 from argparse import ArgumentError
 import requests
+from requests.adapters import HTTPAdapter
 from requests.packages import urllib3
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from openpyxl import Workbook
 from urllib.parse import urljoin, urlparse
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    # Python до 3.11
+    import sre_parse
+
+# С какого числа ячеек engine='auto' переходит на numpy
+NUMPY_MIN_CELLS = 5000
+
+# Роли ARIA: таблица, её строки и ячейки (для таблиц, свёрстанных не через <table>)
+TABLE_ROLES = ("table", "grid", "treegrid")
+ROW_ROLES = ("row",)
+CELL_ROLES = ("cell", "gridcell", "columnheader", "rowheader")
+# Подсказка в class или id, что элемент может быть таблицей
+TABLE_HINT = re.compile("table", re.I)
+# Части таблицы: подсказка в их class/id (<tbody class="table-body">) не делает их отдельной таблицей
+TABLE_PARTS = ("thead", "tbody", "tfoot", "tr", "td", "th", "caption", "colgroup", "col")
+
+# Сколько iframe/frame загружать одновременно
+FRAME_WORKERS = 8
+
+# Пул соединений HTTP: число хостов с отдельным пулом, соединений на хост и ждать ли
+# свободного соединения, когда все POOL_MAXSIZE заняты (иначе открываются лишние)
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+POOL_BLOCK = True
+# Проверять ли сертификаты HTTPS: по умолчанию нет, чтобы брать таблицы и с сайтов
+# с самоподписанным или просроченным сертификатом (предупреждения отключены ниже)
+VERIFY_SSL = False
+
+# Загрузка (см. get_response): предельное время соединения, ожидания данных и всего ответа, сек;
+# повторы при ошибке соединения или ответе из RETRY_STATUSES с паузой до
+# RETRY_BACKOFF * 2 ** попытка (случайной, но не больше RETRY_BACKOFF_MAX)
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+FETCH_DEADLINE = 60
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 8.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Хост отключается после стольких неудачных запросов подряд и на столько секунд
+BREAKER_FAILURES = 5
+BREAKER_COOLDOWN = 60.0
+
+# Сколько страниц параллельный обходчик загружает одновременно
+CRAWL_CONCURRENCY = 8
+
+# Ссылки, которые обходчик отбрасывает без загрузки (см. LinkFilter): схемы и расширения файлов
+SKIP_SCHEMES = ("mailto", "javascript", "tel", "data")
+SKIP_EXTENSIONS = ("pdf", "doc", "docx", "xls", "xlsx", "ppt", "pptx", "odt", "rtf",
+                   "jpg", "jpeg", "png", "gif", "bmp", "svg", "webp", "ico", "tif", "tiff",
+                   "zip", "rar", "7z", "gz", "tgz", "bz2", "xz", "tar", "exe", "msi", "dmg", "iso", "apk",
+                   "css", "js", "json", "xml", "rss", "woff", "woff2", "ttf", "eot",
+                   "mp3", "mp4", "avi", "mov", "mkv", "wav", "ogg", "webm", "flv")
+
+# Вежливость к одному хосту: запросов в секунду (token bucket), запас токенов,
+# одновременных запросов и минимальная пауза между началами запросов, сек
+HOST_RATE = 10.0
+HOST_BURST = 10
+# None - отдельного предела одновременных запросов на хост нет, действует общий concurrency
+# обходчика (обходится один домен, и меньший предел на хост ограничивал бы весь обход)
+HOST_MAX_IN_FLIGHT = None
+HOST_CRAWL_DELAY = 0.0
+
+# Общая сессия всех загрузок (см. get_session) и учёт ошибок хостов (см. get_guard)
+http_session = None
+fetch_guard = None
+
+# Кэш ответов на диске между запусками (см. ResponseCache): каталог и предельный размер
+CACHE_DIR = ".html_cache"
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Общий кэш всех загрузок, None - без кэша (см. set_cache)
+response_cache = None
+
+# Загрузка потоком (см. read_body): какие Content-Type считаются страницей,
+# предельный размер распакованного тела и размер читаемого куска
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+MAX_BODY_BYTES = 32 * 1024 * 1024
+DOWNLOAD_CHUNK = 64 * 1024
+
+# Парсеры BeautifulSoup: html.parser - встроенный, lxml - быстрый, html5lib - как в браузере
+PARSERS = ("html.parser", "lxml", "html5lib")
+DEFAULT_PARSER = "html.parser"
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+class Cell:
+    """ячейка таблицы: текст содержимого и её row и col span"""
+
+    __slots__ = ('value', 'rowspan', 'colspan', 'structure')
+
+    def __init__(self, value, rowspan=1, colspan=1, structure=None):
+        """structure - номер структуры тегов ячейки в пределах таблицы"""
+
+        self.value = value
+        self.rowspan = rowspan
+        self.colspan = colspan
+        self.structure = structure
+
+    def get_copy(self):
+        """Получить копию ячейки"""
+
+        return Cell(self.value, self.rowspan, self.colspan, self.structure)
+
+    def get_transpose(self):
+        """Получить копию ячейки с поменянными местами rowspan и colspan"""
+
+        return Cell(self.value, self.colspan, self.rowspan, self.structure)
+
 class SpanTable:
     """таблица структуры row и col span и содержания таблицы"""
 
-    def __init__(self):
+    def __init__(self, engine='auto'):
+        """
+        engine - чем проверять подлинность:
+            'python' - построчный обход vertical_check,
+            'numpy' - векторизованная проверка SpanMatrix,
+            'auto' - numpy для больших таблиц, если он установлен
+        """
+
         self.table = None
+        self.cells = None
+        self.positions = None
+        self.grid = None
+        self.regular = False
+        self.engine = engine
+        self.matrix = None
+        # Номер таблицы на странице и номер таблицы, в ячейке которой она лежит
+        # (None - таблица верхнего уровня); задаются в iter_genuine_tables
+        self.number = None
+        self.parent = None
 
     def make_table(self, table):
-        """Получение html таблицы и создания структуры"""
+        """
+        Получение html таблицы и создания структуры.
+        Берутся только собственные строки и ячейки таблицы: вложенные таблицы
+        разбираются отдельно (их тоже отдаёт find_all("table")), поэтому каждая ячейка
+        проходится один раз. Из ячеек сразу берутся текст и структура тегов,
+        ссылки на дерево bs4 не сохраняются, поэтому страница может быть освобождена
+        сразу после разбора таблиц.
+        """
 
         table_span = []
+        # Одинаковые структуры тегов получают один номер, сравнение ячеек - сравнение чисел
+        structures = {}
 
-        for row in table.find_all("tr"):
+        for row in self.find_own(table, ("tr",), ROW_ROLES):
 
             if row.decode_contents() == '':
                 continue
 
             row_cells = []
-            for cell in row.find_all(["td", "th"]):
-                rowspan = int(cell.get("rowspan", 1))
-                colspan = int(cell.get("colspan", 1))
-                row_cells += [{
-                                'value': cell,
-                                'rowspan': rowspan,
-                                'colspan': colspan,
-                                'rowspan_original': rowspan,
-                                'colspan_original': colspan,
-                                'similarity': False
-                                }]
+            for cell in self.find_own(row, ("td", "th"), CELL_ROLES):
+                rowspan = int(cell.get("rowspan", cell.get("aria-rowspan", 1)))
+                colspan = int(cell.get("colspan", cell.get("aria-colspan", 1)))
+                structure = structures.setdefault(self.get_tag_structure(cell), len(structures))
+                row_cells += [Cell(cell.get_text(strip=True), rowspan, colspan, structure)]
 
             table_span.append(row_cells)
-        self.table = table_span
+        self.set_table(table_span)
+
+    def get_reject_reason(self, table):
+        """
+        Быстрая проверка html таблицы до make_table.
+        Возвращает причину, по которой таблица точно не подлинная, или None.
+        Ячейки считаются только до второй, так что проверка почти ничего не стоит.
+        """
+
+        if table.get("role") in ("presentation", "none"):
+            return "таблица для вёрстки"
+
+        cells = 0
+        for row in self.find_own(table, ("tr",), ROW_ROLES):
+            for cell in self.find_own(row, ("td", "th"), CELL_ROLES):
+                cells += 1
+                if cells > 1:
+                    return None
+        return "меньше двух ячеек"
+
+    def find_own(self, element, names, roles=()):
+        """
+        Теги names или элементы с ролью ARIA из roles внутри element
+        (например, строки таблицы или ячейки строки),
+        без захода внутрь найденных элементов и вложенных таблиц.
+        Обёртки вроде thead, tbody или form проходятся насквозь.
+        """
+
+        for child in element.children:
+            if child.name is None:
+                continue
+            role = child.get("role")
+            if child.name in names or role in roles:
+                yield child
+            elif child.name != "table" and role not in TABLE_ROLES:
+                yield from self.find_own(child, names, roles)
 
     def set_table(self, table):
         """Задать таблицу в той же структуре"""
 
         self.table = table
+        self.make_grid()
+
+    def get_data(self):
+        """Таблица в виде списков и чисел (для JSON): номер, родитель и строки ячеек"""
+
+        return {"number": self.number, "parent": self.parent,
+                "rows": [[[cell.value, cell.rowspan, cell.colspan, cell.structure] for cell in row]
+                         for row in self.table]}
+
+    def set_data(self, data):
+        """Задать таблицу из данных get_data"""
+
+        self.number = data["number"]
+        self.parent = data["parent"]
+        self.set_table([[Cell(*cell) for cell in row] for row in data["rows"]])
+
+    def make_grid(self):
+        """
+        Раскладка ячеек по логической сетке с учётом rowspan и colspan.
+        Выполняется один раз для таблицы, результатом пользуются
+        транспонирование, отражение и запись в Excel.
+        """
+
+        rows = len(self.table)
+        grid = [[] for _ in range(rows)]
+        cells = []
+        positions = []
+        # Сетка правильная, если ячейки покрывают её ровно своими span без дыр и наложений
+        regular = True
+
+        for i, row in enumerate(self.table):
+            current_col = 0
+            for cell in row:
+                # Находим следующую свободную позицию
+                while current_col < len(grid[i]) and grid[i][current_col] is not None:
+                    current_col += 1
+
+                index = len(cells)
+                cells.append(cell)
+                positions.append((i, current_col))
+
+                # Заполняем позиции согласно rowspan и colspan (не выходя за последнюю строку)
+                if cell.rowspan < 1 or cell.colspan < 1 or i + cell.rowspan > rows:
+                    regular = False
+                colspan = max(cell.colspan, 1)
+                for r in range(i, min(i + max(cell.rowspan, 1), rows)):
+                    grid_row = grid[r]
+                    if len(grid_row) < current_col + colspan:
+                        grid_row.extend([None] * (current_col + colspan - len(grid_row)))
+                    for c in range(current_col, current_col + colspan):
+                        if grid_row[c] is None:
+                            grid_row[c] = index
+                        else:
+                            regular = False
+
+                current_col += colspan
+
+        # Выравниваем строки по ширине самой широкой
+        cols = max((len(grid_row) for grid_row in grid), default=0)
+        for grid_row in grid:
+            grid_row.extend([None] * (cols - len(grid_row)))
+            if regular and None in grid_row:
+                regular = False
+
+        self.cells = cells
+        self.positions = positions
+        self.grid = grid
+        self.regular = regular
+        self.matrix = None
 
     def get_table(self):
         """Получение структуры таблицы"""
 
         return self.table
 
+    def get_grid(self):
+        """Получение сетки: логическая строка/столбец -> индекс ячейки в self.cells"""
+
+        return self.grid
+
     def get_copy(self):
         """Получить копию структуры таблицы"""
 
-        copy = []
-        for i in range(len(self.table)):
-            copy += [[]]
-            for j in range(len(self.table[i])):
-                cell = self.table[i][j]
-                copy[i] += [{
-                             'value': cell['value'],
-                             'rowspan': cell['rowspan'],
-                             'colspan': cell['colspan'],
-                             'rowspan_original': cell['rowspan_original'],
-                             'colspan_original': cell['colspan_original'],
-                             'similarity': cell['similarity']
-                             }]
-        table_span = SpanTable()
-        table_span.set_table(copy)
-        return table_span
+        return self.from_grid(self.grid, lambda cell: cell.get_copy())
 
     def get_flip(self):
         """Получить таблицу отраженную относительно вертикали"""
 
-        flip = self.get_copy().get_table()
-        for i in range(len(flip)):
-            flip[i] = flip[i][::-1]
-
-        table_span = SpanTable()
-        table_span.set_table(flip)
-        return table_span
+        flip = [grid_row[::-1] for grid_row in self.grid]
+        return self.from_grid(flip, lambda cell: cell.get_copy())
 
     def get_transpose(self):
         """Получить транспонированную таблицу"""
 
-        rows_data = self.get_table()
+        transposed = list(map(list, zip(*self.grid)))
+        return self.from_grid(transposed, lambda cell: cell.get_transpose())
 
-        if not rows_data or not rows_data[0]:
-            return []
-
-        # Определяем размеры исходной таблицы
-        rows = len(rows_data)
-        cols = sum(cell['colspan'] for cell in rows_data[0])
-
-        # Создаем матрицу для отслеживания занятых ячеек
-        matrix = [[None for _ in range(cols)] for _ in range(rows)]
-
-        # Заполняем матрицу данными и отмечаем занятые ячейки
-        for i, row in enumerate(rows_data):
-            current_col = 0
-            for cell in row:
-                # Находим следующую свободную позицию
-                while current_col < cols and matrix[i][current_col] is not None:
-                    current_col += 1
-
-                # Заполняем ячейки согласно rowspan и colspan
-                for r in range(cell['rowspan']):
-                    for c in range(cell['colspan']):
-                        if i + r < rows and current_col + c < cols:
-                            matrix[i + r][current_col + c] = cell
+    def from_grid(self, grid, make_cell):
+        """
+        Собрать новую таблицу по уже разложенной сетке индексов ячеек этой таблицы.
+        Ячейка попадает в ту строку, где она впервые встречается в сетке,
+        поэтому повторная раскладка span не нужна.
+        """
 
-                current_col += cell['colspan']
+        index = {}
+        table = []
+        cells = []
+        positions = []
+        new_grid = []
 
-        # Транспонируем матрицу
-        transposed_matrix = list(map(list, zip(*matrix)))
-
-        # Создаем новую структуру данных
-        transposed_data = []
-        processed_cells = set()
-
-        for i, row in enumerate(transposed_matrix):
+        for i, grid_row in enumerate(grid):
+            row_cells = []
             new_row = []
-            for j, cell in enumerate(row):
-                if cell is not None and (i, j) not in processed_cells:
-                    # Создаем новую ячейку с поменянными местами rowspan и colspan
-                    new_cell = {
-                        'value': cell['value'],
-                        'rowspan': cell['colspan'],  # Меняем местами
-                        'colspan': cell['rowspan'],  # Меняем местами
-                        'rowspan_original': cell['colspan_original'],  # Меняем местами
-                        'colspan_original': cell['rowspan_original'],   # Меняем местами
-                        'similarity': cell['similarity']
-                    }
-                    new_row.append(new_cell)
-
-                    # Отмечаем обработанные ячейки
-                    for r in range(new_cell['rowspan']):
-                        for c in range(new_cell['colspan']):
-                            processed_cells.add((i + r, j + c))
-
-            if new_row:  # Добавляем строку только если в ней есть ячейки
-                transposed_data.append(new_row)
-
-        table_span = SpanTable()
-        table_span.set_table(transposed_data)
+            for j, old_index in enumerate(grid_row):
+                if old_index is None:
+                    new_row.append(None)
+                    continue
+                if old_index not in index:
+                    index[old_index] = len(cells)
+                    cell = make_cell(self.cells[old_index])
+                    cells.append(cell)
+                    positions.append((i, j))
+                    row_cells.append(cell)
+                new_row.append(index[old_index])
+            table.append(row_cells)
+            new_grid.append(new_row)
+
+        table_span = SpanTable(self.engine)
+        table_span.table = table
+        table_span.cells = cells
+        table_span.positions = positions
+        table_span.grid = new_grid
+        table_span.regular = self.regular
         return table_span
 
     def get_type_of_genuine(self):
-        if self.is_top():
-            return 'top'
-        if self.is_left():
-            return 'left'
-        if self.is_right():
-            return 'right'
-        if self.is_bottom():
-            return 'bottom'
+        types = self.get_types_of_genuine(first_only=True)
+        if types:
+            return types[0]
         return "not"
 
+    def get_types_of_genuine(self, first_only=False):
+        """
+        Все ориентации, в которых таблица подлинная, в порядке top, left, right, bottom.
+        Проверки ориентаций идут одновременно по строкам, ориентация выбывает при первой ошибке,
+        поэтому неподлинная таблица отбрасывается, как только отпали все четыре.
+        first_only - остановиться на первой по порядку подлинной ориентации
+        """
+
+        orientations = ('top', 'left', 'right', 'bottom')
+        verdicts = {}
+
+        matrix = self.get_matrix()
+        if matrix is not None:
+            for orientation in orientations:
+                verdicts[orientation] = matrix.vertical_check(orientation)
+                if first_only and verdicts[orientation]:
+                    return [orientation]
+            return [orientation for orientation in orientations if verdicts[orientation]]
+
+        checks = {orientation: self.vertical_steps(TableView(self, orientation)) for orientation in orientations}
+        while checks:
+            for orientation in list(checks):
+                verdict = next(checks[orientation])
+                if verdict is not None:
+                    verdicts[orientation] = verdict
+                    del checks[orientation]
+
+            if first_only:
+                for orientation in orientations:
+                    if orientation not in verdicts:
+                        break
+                    if verdicts[orientation]:
+                        return [orientation]
+
+        return [orientation for orientation in orientations if verdicts[orientation]]
+
     def get_tag_structure(self, element):
-        """Получает структуру тегов элемента в виде списка"""
+        """Получает структуру тегов элемента в виде вложенного кортежа"""
 
         structure = []
 
@@ -178,16 +423,68 @@ class SpanTable:
             if child_structure:
                 structure.append(child_structure)
 
-        return structure
+        return tuple(structure)
+
+    def get_structure_ids(self):
+        """Номера структур тегов ячеек по индексам: одинаковая структура - одинаковый номер"""
 
-    def vertical_check(self):
-        """Проверка на подлиность вертикальных таблиц"""
+        return [cell.structure for cell in self.cells]
 
-        table_spans = self.get_copy().get_table()
+    def get_matrix(self):
+        """
+        SpanMatrix для векторизованной проверки или None,
+        если выбран python, numpy не установлен или сетка неправильная
+        """
+
+        if self.engine == 'python' or np is None or not self.regular:
+            return None
+        if self.engine == 'auto' and len(self.cells) < NUMPY_MIN_CELLS:
+            return None
+        if self.matrix is None:
+            self.matrix = SpanMatrix(self)
+        return self.matrix
+
+    def check_orientation(self, orientation):
+        """Проверка подлинности в заданной ориентации выбранным движком"""
+
+        matrix = self.get_matrix()
+        if matrix is not None:
+            return matrix.vertical_check(orientation)
+        return self.vertical_check(TableView(self, orientation))
+
+    def vertical_check(self, view=None):
+        """
+        Проверка на подлиность вертикальных таблиц.
+        view - представление таблицы (TableView), по умолчанию ориентация top
+        """
+
+        for verdict in self.vertical_steps(view):
+            if verdict is not None:
+                return verdict
+
+    def vertical_steps(self, view=None):
+        """
+        Пошаговая проверка vertical_check: после каждой строки выдаёт None,
+        последним значением выдаёт результат проверки.
+        Позволяет вести проверки нескольких ориентаций одновременно.
+        """
+
+        if view is None:
+            view = TableView(self)
+
+        table_spans = view.get_rows()
         if len(table_spans) < 2:
-            return False
+            yield False
+            return
+
+        # Оставшиеся rowspan и флаги совпадения ведутся в своих списках по индексам ячеек,
+        # таблица только читается, поэтому копия не нужна и проверку можно вести на общей таблице
+        rowspan = view.get_rowspans()
+        colspan = view.get_colspans()
+        similarity = [False] * len(rowspan)
+        structure = self.get_structure_ids()
 
-        old = [cell for cell in table_spans[0]]
+        old = [index for index in table_spans[0]]
         new = []
 
         for i in range(1, len(table_spans)):
@@ -195,82 +492,814 @@ class SpanTable:
             s = 0
 
             for k in range(len(old)):
-                old[k]["rowspan"] -= 1
+                rowspan[old[k]] -= 1
+
+            # Наименьший оставшийся rowspan среди ячеек, продолжающихся в эту строку:
+            # новая ячейка строки не должна заканчиваться ниже любой из них
+            carried = [rowspan[index] for index in old if rowspan[index] > 0]
+            min_carried = min(carried) if carried else None
 
             k = 0
 
             while k < len(old):
 
-                if old[k]["rowspan"] > 0:
+                if rowspan[old[k]] > 0:
                     new += [old[k]]
                     k += 1
                     continue
 
                 if j < len(table_spans[i]):
-                    for old_cell in old:
-                        #print(old_cell["rowspan"], old_cell["rowspan_original"], table_spans[i][j]["rowspan"], '||||', old_cell["rowspan_original"] - old_cell["rowspan"], table_spans[i][j]["rowspan"] - old_cell["rowspan"] )
-                        if (old_cell["rowspan"] > 0) and (old_cell["rowspan_original"] - old_cell["rowspan"] > 0 ) and (table_spans[i][j]["rowspan"] - old_cell["rowspan"]  > 0):
-                            return False
-
-                    if (s + table_spans[i][j]["colspan"]) < old[k]["colspan"]:
-                        s += table_spans[i][j]["colspan"]
-                        new += [table_spans[i][j]]
+                    current = table_spans[i][j]
+                    if min_carried is not None and rowspan[current] > min_carried:
+                        yield False
+                        return
+
+                    if (s + colspan[current]) < colspan[old[k]]:
+                        s += colspan[current]
+                        new += [current]
                         j += 1
                         continue
 
-                    if (s + table_spans[i][j]["colspan"]) == old[k]["colspan"]:
+                    if (s + colspan[current]) == colspan[old[k]]:
 
                         if s == 0:
-                            table_spans[i][j]['similarity'] = True
-                            if old[k]["similarity"]:
-                                old_structure = self.get_tag_structure(old[k]['value'])
-                                new_structure = self.get_tag_structure(table_spans[i][j]['value'])
-                                if not (old_structure == new_structure):
-                                    return False
+                            similarity[current] = True
+                            if similarity[old[k]]:
+                                if structure[old[k]] != structure[current]:
+                                    yield False
+                                    return
                         s = 0
-                        new += [table_spans[i][j]]
+                        new += [current]
                         j += 1
                         k += 1
                         continue
 
-                return False
+                yield False
+                return
 
             if not ((j == len(table_spans[i])) and (k == len(old))):
-                return False
+                yield False
+                return
             old = []
-            old = [cell for cell in new]
+            old = [index for index in new]
             new = []
+            yield None
 
-        if not (all(cell['rowspan'] == 1 for cell in old)):
-            return False
-        return True
+        if not (all(rowspan[index] == 1 for index in old)):
+            yield False
+            return
+        yield True
 
     def is_top(self):
-        return self.vertical_check()
+        return self.check_orientation('top')
 
     def is_left(self):
-        table_span = self.get_transpose()
-        return table_span.vertical_check()
+        return self.check_orientation('left')
 
     def is_right(self):
-        table_span = self.get_flip().get_transpose()
-        return table_span.vertical_check()
+        return self.check_orientation('right')
 
     def is_bottom(self):
-        table_span = self.get_transpose().get_flip().get_transpose()
-        return table_span.vertical_check()
+        return self.check_orientation('bottom')
+
+class TableView:
+    """
+    Представление SpanTable в одной из ориентаций без копирования ячеек.
+    top - как есть, left - транспонированная, right - отражённая и транспонированная,
+    bottom - отражённая относительно горизонтали.
+    Координаты пересчитываются в сетку исходной таблицы,
+    rowspan и colspan меняются местами только при обращении к ним.
+    """
+
+    def __init__(self, table_span, orientation='top'):
+        self.table_span = table_span
+        self.orientation = orientation
+        self.transposed = orientation in ('left', 'right')
+
+        grid = table_span.get_grid()
+        rows = len(grid)
+        cols = len(grid[0]) if rows else 0
+        if self.transposed:
+            rows, cols = cols, rows
+        self.rows = rows
+        self.cols = cols
+        self._rows = None
+
+    def get_line(self, i):
+        """Строка i представления: индексы ячеек исходной таблицы по столбцам"""
+
+        grid = self.table_span.get_grid()
+        if self.orientation == 'top':
+            return grid[i]
+        if self.orientation == 'left':
+            return [grid_row[i] for grid_row in grid]
+        if self.orientation == 'right':
+            return [grid_row[self.rows - 1 - i] for grid_row in grid]
+        return grid[self.rows - 1 - i]
+
+    def get_rows(self):
+        """Строки представления: индексы ячеек, которые начинаются в каждой строке"""
+
+        if self._rows is None:
+            seen = [False] * len(self.table_span.cells)
+            rows = []
+            for i in range(self.rows):
+                row = []
+                for index in self.get_line(i):
+                    if index is not None and not seen[index]:
+                        seen[index] = True
+                        row.append(index)
+                rows.append(row)
+            self._rows = rows
+        return self._rows
+
+    def get_rowspans(self):
+        """rowspan ячеек в этой ориентации по индексам"""
+
+        if self.transposed:
+            return [cell.colspan for cell in self.table_span.cells]
+        return [cell.rowspan for cell in self.table_span.cells]
+
+    def get_colspans(self):
+        """colspan ячеек в этой ориентации по индексам"""
+
+        if self.transposed:
+            return [cell.rowspan for cell in self.table_span.cells]
+        return [cell.colspan for cell in self.table_span.cells]
+
+class SpanMatrix:
+    """
+    Таблица правильной сетки в массивах numpy: индексы ячеек по логической сетке,
+    rowspan, colspan, позиции и номера структур тегов по ячейкам.
+    Проверка подлинности выполняется векторно и совпадает с SpanTable.vertical_check.
+    """
+
+    def __init__(self, table_span):
+        grid = table_span.get_grid()
+        self.grid = np.array(grid, dtype=np.int64).reshape(len(grid), len(grid[0]) if grid else 0)
+        self.rowspan = np.array([cell.rowspan for cell in table_span.cells], dtype=np.int64)
+        self.colspan = np.array([cell.colspan for cell in table_span.cells], dtype=np.int64)
+        positions = np.array(table_span.positions, dtype=np.int64).reshape(-1, 2)
+        self.anchor_row = positions[:, 0]
+        self.anchor_col = positions[:, 1]
+        self.structure = np.array(table_span.get_structure_ids(), dtype=np.int64)
+
+    def get_orientation(self, orientation):
+        """Сетка, rowspan, colspan и позиции ячеек в заданной ориентации"""
+
+        rows, cols = self.grid.shape
+        if orientation == 'top':
+            return self.grid, self.rowspan, self.colspan, self.anchor_row, self.anchor_col
+        if orientation == 'left':
+            return self.grid.T, self.colspan, self.rowspan, self.anchor_col, self.anchor_row
+        if orientation == 'right':
+            return (self.grid[:, ::-1].T, self.colspan, self.rowspan,
+                    cols - self.anchor_col - self.colspan, self.anchor_row)
+        return (self.grid[::-1, :], self.rowspan, self.colspan,
+                rows - self.anchor_row - self.rowspan, self.anchor_col)
+
+    def vertical_check(self, orientation='top'):
+        """Векторная проверка на подлиность вертикальных таблиц"""
+
+        grid, rowspan, colspan, anchor_row, anchor_col = self.get_orientation(orientation)
+        rows = grid.shape[0]
+        if rows < 2:
+            return False
+
+        up = grid[:-1]
+        down = grid[1:]
+        # Ячейка продолжается с предыдущей строки
+        carried = down == up
+
+        # Новая ячейка не должна заканчиваться ниже продолжающихся ячеек своей строки
+        bottom = (anchor_row + rowspan)[down]
+        min_carried = np.where(carried, bottom, rows + 1).min(axis=1, initial=rows + 1)
+        max_new = np.where(carried, 0, bottom).max(axis=1, initial=0)
+        if (max_new > min_carried).any():
+            return False
+
+        # Новая ячейка не должна пересекать границу между ячейками строки выше
+        straddle = ~carried[:, 1:] & (down[:, 1:] == down[:, :-1]) & (up[:, 1:] != up[:, :-1])
+        if straddle.any():
+            return False
+
+        # Ячейка совпадает по столбцам с ячейкой над ней - их структуры тегов должны совпадать,
+        # если и та совпадала со своей верхней
+        has_parent = anchor_row > 0
+        parent = np.where(has_parent, grid[np.maximum(anchor_row - 1, 0), anchor_col], 0)
+        exact = has_parent & (anchor_col[parent] == anchor_col) & (colspan[parent] == colspan)
+        similar = exact & exact[parent]
+        if (similar & (self.structure[parent] != self.structure)).any():
+            return False
+        return True
+
+class TableStream(HTMLParser):
+    """
+    Потоковый разбор html по кускам (feed).
+    Собирает разметку каждой таблицы верхнего уровня (вместе с вложенными)
+    и откладывает её в ready, как только закрыт её </table>. Остальная страница не хранится.
+    """
+
+    def __init__(self, data=None):
+        """
+        data - исходные байты utf-8 (например, mmap файла), из которых декодированы куски для feed.
+        Если заданы, для каждой таблицы запоминаются байтовые смещения её начала и конца
+        """
+
+        super().__init__(convert_charrefs=True)
+        self.depth = 0
+        self.parts = []
+        self.ready = []
+        self.data = data
+        self.start = None
+        # Последняя вычисленная позиция: строка и столбец HTMLParser и байтовое смещение
+        self.line = 1
+        self.col = 0
+        self.pos = 0
+
+    def get_byte_offset(self):
+        """
+        Байтовое смещение в data тега, который сейчас обрабатывается.
+        Позиции тегов только растут, поэтому пересчёт идёт от предыдущей позиции,
+        и весь файл проходится один раз даже при очень длинных строках.
+        """
+
+        line, col = self.getpos()
+        while self.line < line:
+            self.pos = self.data.find(b"\n", self.pos) + 1
+            self.line += 1
+            self.col = 0
+        # Символ utf-8 занимает не больше 4 байт
+        text = bytes(self.data[self.pos:self.pos + 4 * (col - self.col)]).decode("utf-8", "ignore")
+        self.pos += len(text[:col - self.col].encode("utf-8"))
+        self.col = col
+        return self.pos
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            if not self.depth and self.data is not None:
+                self.start = self.get_byte_offset()
+            self.depth += 1
+        if self.depth:
+            self.parts.append(self.get_starttag_text())
+
+    def handle_startendtag(self, tag, attrs):
+        if self.depth and tag != "table":
+            self.parts.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if not self.depth:
+            return
+        self.parts.append(f"</{tag}>")
+        if tag == "table":
+            self.depth -= 1
+            if not self.depth:
+                end = None
+                if self.data is not None:
+                    end = self.data.find(b">", self.get_byte_offset()) + 1
+                self.ready.append(("".join(self.parts), self.start, end))
+                self.parts = []
+
+    def handle_data(self, data):
+        if self.depth:
+            # Текст <script> и <style> не разбирается на сущности ни здесь, ни при повторном разборе
+            if self.cdata_elem:
+                self.parts.append(data)
+            else:
+                self.parts.append(html.escape(data, quote=False))
+
+    def handle_comment(self, data):
+        if self.depth:
+            self.parts.append(f"<!--{data}-->")
+
+    def unknown_decl(self, data):
+        # Помеченные секции внутри таблицы: <![CDATA[...]]> (data без "]]>"), <![if ...]> (data без "]>")
+        if self.depth:
+            end = "]]>" if data.startswith("CDATA[") else "]>"
+            self.parts.append(f"<![{data}{end}")
+
+    def close(self):
+        """Завершение разбора: незакрытая таблица в конце файла тоже отдаётся"""
+
+        super().close()
+        if self.parts:
+            end = len(self.data) if self.data is not None else None
+            self.ready.append(("".join(self.parts), self.start, end))
+            self.parts = []
+            self.depth = 0
+
+    def pop_ready(self):
+        """Забрать уже закрытые таблицы: (разметка, байт начала, байт конца)"""
+
+        ready = self.ready
+        self.ready = []
+        return ready
+
+class HostState:
+    """Состояние одного хоста в HostScheduler: токены, одновременные запросы и статистика"""
+
+    __slots__ = ('tokens', 'updated', 'last_start', 'in_flight',
+                 'requests', 'throttled', 'wait_total', 'wait_max')
+
+    def __init__(self, burst, max_in_flight):
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.last_start = None
+        self.in_flight = asyncio.Semaphore(max_in_flight) if max_in_flight is not None else None
+        self.requests = 0
+        self.throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+class HostScheduler:
+    """
+    Вежливая очередь запросов asyncio по хостам.
+    У каждого хоста свой token bucket (rate запросов в секунду, запас burst),
+    не больше max_in_flight запросов одновременно (None - без отдельного предела)
+    и пауза crawl_delay между началами запросов.
+    Запросы к разным хостам друг друга не ждут, поэтому при обходе нескольких хостов
+    они чередуются, а нагрузка на каждый остаётся ограниченной.
+    """
+
+    def __init__(self, rate=HOST_RATE, burst=HOST_BURST, max_in_flight=HOST_MAX_IN_FLIGHT,
+                 crawl_delay=HOST_CRAWL_DELAY):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.crawl_delay = crawl_delay
+        self.hosts = {}
+
+    def get_state(self, host):
+        """Состояние хоста, создаётся при первом запросе к нему"""
+
+        if host not in self.hosts:
+            self.hosts[host] = HostState(self.burst, self.max_in_flight)
+        return self.hosts[host]
+
+    def get_wait(self, state):
+        """Сколько секунд хосту ждать следующего запроса (0 - можно сейчас); пополняет токены"""
+
+        now = time.monotonic()
+        state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+        state.updated = now
+        wait = (1 - state.tokens) / self.rate if state.tokens < 1 else 0.0
+        if state.last_start is not None:
+            wait = max(wait, state.last_start + self.crawl_delay - now)
+        return wait
+
+    async def acquire(self, url, slots=None):
+        """
+        Дождаться разрешения на запрос к хосту url.
+        slots - общий asyncio.Semaphore обхода или None. Место в нём занимается, только когда
+        хост готов к запросу, а токен и время начала запроса берутся уже с занятым местом:
+        запросы, ждавшие место, не уходят к хосту пачкой
+        Возвращает:
+            хост, который нужно передать в release после запроса
+        """
+
+        host = urlparse(url).netloc
+        state = self.get_state(host)
+        queued = time.monotonic()
+        if state.in_flight is not None:
+            await state.in_flight.acquire()
+
+        throttled = False
+        while True:
+            wait = self.get_wait(state)
+            if wait > 0:
+                throttled = True
+                await asyncio.sleep(wait)
+                continue
+            if slots is None:
+                break
+            await slots.acquire()
+            # Пока ждали место, хост мог получить другие запросы
+            if self.get_wait(state) <= 0:
+                break
+            slots.release()
+            throttled = True
+
+        now = time.monotonic()
+        state.tokens -= 1
+        state.last_start = now
+        state.requests += 1
+        state.throttled += throttled
+        delay = now - queued
+        state.wait_total += delay
+        state.wait_max = max(state.wait_max, delay)
+        return host
+
+    def release(self, host, slots=None):
+        """Запрос к хосту закончен; slots - тот же семафор, что был передан в acquire"""
+
+        if self.hosts[host].in_flight is not None:
+            self.hosts[host].in_flight.release()
+        if slots is not None:
+            slots.release()
+
+    def get_report(self):
+        """Статистика по хостам: запросы, сколько из них придержано, ожидание в очереди"""
+
+        return {host: {'requests': state.requests,
+                       'throttled': state.throttled,
+                       'wait_avg': state.wait_total / state.requests if state.requests else 0.0,
+                       'wait_max': state.wait_max}
+                for host, state in self.hosts.items()}
+
+    def print_report(self):
+        for host, stats in self.get_report().items():
+            print(f"{host}: запросов {stats['requests']}, придержано {stats['throttled']}, "
+                  f"ожидание в очереди среднее {stats['wait_avg']:.3f} с, максимум {stats['wait_max']:.3f} с")
+
+class HostHealth:
+    """Состояние одного хоста в FetchGuard: ошибки подряд, отключение и статистика"""
+
+    __slots__ = ('failures', 'opened_until', 'probing',
+                 'requests', 'errors', 'trips', 'latency_total', 'latency_max')
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_until = None
+        self.probing = False
+        self.requests = 0
+        self.errors = {}
+        self.trips = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+class FetchGuard:
+    """
+    Автомат отключения хостов (circuit breaker) и счётчики загрузок по хостам.
+    После max_failures неудачных запросов подряд хост отключается на cooldown секунд:
+    запросы к нему сразу завершаются HostUnavailable, не дожидаясь таймаутов.
+    По истечении cooldown пропускается один пробный запрос: удача включает хост,
+    неудача отключает снова.
+    Можно использовать из нескольких потоков.
+    """
+
+    def __init__(self, max_failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def get_state(self, host):
+        """Состояние хоста, создаётся при первом запросе к нему"""
+
+        if host not in self.hosts:
+            self.hosts[host] = HostHealth()
+        return self.hosts[host]
+
+    def allow(self, host):
+        """Можно ли сейчас отправить запрос к хосту"""
+
+        with self.lock:
+            state = self.get_state(host)
+            if state.opened_until is None:
+                return True
+            if time.monotonic() < state.opened_until or state.probing:
+                return False
+            state.probing = True
+            return True
+
+    def record(self, host, latency, error=None, failure=None):
+        """
+        Учесть запрос к хосту: время ответа и ошибку (None - ошибки нет).
+        failure - говорит ли ошибка о недоступности хоста; по умолчанию да, если ошибка есть.
+        Ошибки, после которых хост всё же ответил (сертификат, редиректы), только считаются
+        и, как удачный запрос, включают хост.
+        """
+
+        if failure is None:
+            failure = error is not None
+        with self.lock:
+            state = self.get_state(host)
+            state.requests += 1
+            state.latency_total += latency
+            state.latency_max = max(state.latency_max, latency)
+            if error is not None:
+                state.errors[error] = state.errors.get(error, 0) + 1
+            if not failure:
+                state.failures = 0
+                state.opened_until = None
+                state.probing = False
+                return
+            state.failures += 1
+            if state.probing or state.failures >= self.max_failures:
+                state.opened_until = time.monotonic() + self.cooldown
+                state.probing = False
+                state.trips += 1
+
+    def get_report(self):
+        """Статистика по хостам: запросы, ошибки по видам, отключения, время ответа"""
+
+        with self.lock:
+            return {host: {'requests': state.requests,
+                           'errors': dict(state.errors),
+                           'trips': state.trips,
+                           'latency_avg': state.latency_total / state.requests if state.requests else 0.0,
+                           'latency_max': state.latency_max}
+                    for host, state in self.hosts.items()}
+
+    def print_report(self):
+        for host, stats in self.get_report().items():
+            errors = ", ".join(f"{error} {count}" for error, count in stats['errors'].items()) or "нет"
+            print(f"{host}: запросов {stats['requests']}, ошибок: {errors}, отключений {stats['trips']}, "
+                  f"ответ средний {stats['latency_avg']:.3f} с, максимум {stats['latency_max']:.3f} с")
+
+class LinkFilter:
+    """
+    Быстрый отбор ссылок обходчика до загрузки.
+    Отбрасываются ссылки со схемами SKIP_SCHEMES (проверка по href до urljoin),
+    с расширениями из extensions, совпавшие с exclude и, если include задан,
+    не совпавшие ни с одним include. Шаблон - glob по всему url ("*/docs/*")
+    или регулярное выражение с префиксом "re:" (ищется в любом месте url).
+    Все расширения и шаблоны exclude собраны в одно регулярное выражение,
+    include - во второе, так что на ссылку приходится не больше двух поисков.
+    Отброшенные url считаются по причинам без повторов (см. get_report).
+    """
+
+    def __init__(self, include=(), exclude=(), extensions=SKIP_EXTENSIONS, schemes=SKIP_SCHEMES):
+        self.skip_scheme = re.compile(r"\s*(?:%s):" % "|".join(map(re.escape, schemes)), re.I)
+        parts = []
+        if extensions:
+            parts.append(r"(?P<extension>(?i:\.(?:%s))\Z)" % "|".join(map(re.escape, extensions)))
+        if exclude:
+            parts.append("(?P<exclude>%s)" % "|".join(self.get_pattern(p) for p in exclude))
+        self.skip = re.compile("|".join(parts)) if parts else None
+        self.keep = re.compile("|".join(self.get_pattern(p) for p in include)) if include else None
+        self.dropped = {'scheme': set(), 'extension': set(), 'exclude': set(), 'include': set()}
+
+    @staticmethod
+    def get_pattern(pattern):
+        """
+        Регулярное выражение для шаблона: "re:..." как есть, иначе glob по всему url.
+        Каждое регулярное выражение сначала компилируется отдельно, чтобы ошибка называла шаблон.
+        Флаги в начале ("re:(?i)docs") в объединённом выражении были бы не в начале,
+        поэтому они становятся флагами группы этого шаблона: (?i:docs).
+        Номера групп в объединённом выражении сдвигаются, а имена могут повториться,
+        поэтому ссылки на группы (\\1, (?P=name), (?(1)...)) и именованные группы не допускаются.
+        """
+
+        if not pattern.startswith("re:"):
+            return r"\A" + fnmatch.translate(pattern)
+        regex = pattern[3:]
+        try:
+            compiled = re.compile(regex)
+        except re.error as e:
+            raise ValueError(f"Invalid link pattern {pattern!r}: {e}")
+        if compiled.groupindex or LinkFilter.has_group_reference(sre_parse.parse(regex)):
+            raise ValueError(f"Invalid link pattern {pattern!r}: backreferences and named groups are not supported")
+        flags = ""
+        match = re.match(r"\(\?([aiLmsux]+)\)", regex)
+        while match:
+            flags += match.group(1)
+            regex = regex[match.end():]
+            match = re.match(r"\(\?([aiLmsux]+)\)", regex)
+        return "(?%s:%s)" % (flags, regex)
+
+    @staticmethod
+    def has_group_reference(items):
+        """Есть ли в выражении, разобранном sre_parse, ссылки на группы"""
+
+        for op, av in items:
+            if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+                return True
+            # Вложенные выражения: группы, повторы, проверки, ветви "|"
+            for value in av if isinstance(av, (tuple, list)) else (av,):
+                if isinstance(value, list) and value and isinstance(value[0], sre_parse.SubPattern):
+                    if any(LinkFilter.has_group_reference(branch) for branch in value):
+                        return True
+                elif isinstance(value, sre_parse.SubPattern) and LinkFilter.has_group_reference(value):
+                    return True
+        return False
+
+    def skip_href(self, href):
+        """Отбросить href до приведения к абсолютному url (mailto:, javascript: ...)"""
+
+        if self.skip_scheme.match(href):
+            self.dropped['scheme'].add(href.strip())
+            return True
+        return False
+
+    def accept(self, url):
+        """Нужно ли загружать абсолютный url"""
+
+        if self.skip is not None:
+            match = self.skip.search(url)
+            if match:
+                self.dropped[match.lastgroup].add(url)
+                return False
+        if self.keep is not None and not self.keep.search(url):
+            self.dropped['include'].add(url)
+            return False
+        return True
+
+    def get_report(self):
+        """Сколько разных url отброшено по каждой причине - столько запросов не отправлено"""
+
+        return {reason: len(urls) for reason, urls in self.dropped.items()}
+
+    def print_report(self):
+        report = self.get_report()
+        print(f"Ссылок отброшено без загрузки: {sum(report.values())} "
+              f"(схема {report['scheme']}, расширение {report['extension']}, "
+              f"exclude {report['exclude']}, не include {report['include']})")
+
+class ResponseCache:
+    """
+    Кэш ответов HTTP на диске.
+    Тела лежат в objects/ под своим sha256, одинаковые страницы хранятся один раз.
+    index.json по url хранит хэш тела, кодировку, ETag, Last-Modified и время последнего
+    обращения; по нему делается условный запрос, а при превышении max_bytes
+    удаляются давно не использованные записи (LRU).
+    Рядом с телом, в objects/<sha256>.<имя>, лежат результаты его разбора (put_extra):
+    ссылки и проверенные таблицы. При ответе 304 страница по ним не разбирается заново;
+    их размер входит в размер записи, и удаляются они вместе с телом.
+    Тела, которых нет в index.json (запуск прервался до save), удаляются при открытии кэша,
+    иначе они не учитывались бы в max_bytes.
+    Можно использовать из нескольких потоков.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.index_path = os.path.join(directory, "index.json")
+        self.index = {}
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        self.remove_orphans()
+
+    def remove_orphans(self):
+        """Удалить файлы objects/, на которые не ссылается index (и недописанные .tmp)"""
+
+        used = {entry["hash"] for entry in self.index.values()}
+        objects = os.path.join(self.directory, "objects")
+        for name in os.listdir(objects):
+            if name.split(".")[0] not in used or name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(objects, name))
+                except OSError:
+                    pass
+
+    def get_object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest)
+
+    def get(self, url):
+        """Запись кэша для url или None"""
+
+        with self.lock:
+            entry = self.index.get(url)
+            if entry is not None:
+                entry["used"] = time.time()
+            return entry
+
+    def read(self, entry):
+        """Тело ответа из записи кэша (None, если файл тела пропал)"""
+
+        try:
+            with open(self.get_object_path(entry["hash"]), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, url, body, encoding, headers):
+        """
+        Сохранить ответ, если сервер дал ETag или Last-Modified, и соблюсти предельный размер.
+        Возвращает:
+            sha256 тела или None, если ответ не сохранён
+        """
+
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if etag is None and last_modified is None:
+            return None
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.get_object_path(digest)
+        with self.lock:
+            if not os.path.isfile(path):
+                with open(path + ".tmp", "wb") as f:
+                    f.write(body)
+                os.replace(path + ".tmp", path)
+            previous = self.index.get(url)
+            # Размер тела вместе с уже сохранёнными результатами разбора (как у других url с этим телом)
+            size = next((entry["size"] for entry in self.index.values() if entry["hash"] == digest), len(body))
+            self.index[url] = {"hash": digest, "size": size, "encoding": encoding,
+                               "etag": etag, "last_modified": last_modified, "used": time.time()}
+            # Прежнее тело страницы больше не нужно, если на него не ссылаются другие url
+            if previous is not None and previous["hash"] != digest:
+                self.remove_unused(previous["hash"])
+            self.evict()
+        return digest
+
+    def get_extra(self, digest, name):
+        """Результат разбора name, сохранённый put_extra для тела digest, или None"""
+
+        try:
+            with open(self.get_object_path(digest) + "." + name, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put_extra(self, digest, name, data):
+        """
+        Сохранить рядом с телом digest результат его разбора name (данные для JSON).
+        Тело, которого нет в index, не дополняется: 304 для него не придёт.
+        Результат разбора тела не меняется, поэтому уже сохранённый не перезаписывается.
+        """
+
+        path = self.get_object_path(digest) + "." + name
+        text = json.dumps(data, ensure_ascii=False)
+        with self.lock:
+            entries = [entry for entry in self.index.values() if entry["hash"] == digest]
+            if not entries or os.path.isfile(path):
+                return
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+            size = os.path.getsize(path)
+            for entry in entries:
+                entry["size"] += size
+            self.evict()
+
+    def remove_unused(self, digest):
+        """
+        Удалить тело digest и результаты его разбора из objects/,
+        если на тело не ссылается ни одна запись index.
+        Возвращает:
+            True, если файлы удалены
+        """
+
+        if any(entry["hash"] == digest for entry in self.index.values()):
+            return False
+        objects = os.path.join(self.directory, "objects")
+        for name in os.listdir(objects):
+            if name.split(".")[0] == digest:
+                try:
+                    os.remove(os.path.join(objects, name))
+                except OSError:
+                    pass
+        return True
+
+    def evict(self):
+        """Удалить самые давно использованные записи, пока тела не уложатся в max_bytes"""
+
+        sizes = {entry["hash"]: entry["size"] for entry in self.index.values()}
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+        for url in sorted(self.index, key=lambda url: self.index[url]["used"]):
+            if total <= self.max_bytes:
+                break
+            digest = self.index.pop(url)["hash"]
+            if self.remove_unused(digest):
+                total -= sizes[digest]
+
+    def save(self):
+        """Записать index.json (вызывается в конце работы)"""
+
+        with self.lock:
+            with open(self.index_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.index, f)
+            os.replace(self.index_path + ".tmp", self.index_path)
+
+class SkippedDownload(requests.RequestException):
+    """Загрузка прервана: ответ не HTML или тело больше MAX_BODY_BYTES"""
+
+class HostUnavailable(requests.RequestException):
+    """Хост отключён FetchGuard после ошибок подряд, запрос не отправлялся"""
+
+class Page:
+    """
+    Загруженная страница: код ответа, тело, кодировка, изменилась ли она с прошлого раза
+    (False - ответ 304, тело из кэша) и sha256 тела в кэше ответов (None - не в кэше)
+    """
+
+    __slots__ = ('url', 'status', 'body', 'encoding', 'changed', 'digest')
+
+    def __init__(self, url, status, body, encoding, changed=True, digest=None):
+        self.url = url
+        self.status = status
+        self.body = body
+        self.encoding = encoding
+        self.changed = changed
+        self.digest = digest
+
+    def get_text(self):
+        return self.body.decode(self.encoding or "utf-8", errors="replace")
 
 def write_to_excel(output_excel_path, tables_span):
     """
     Функция для записи таблиц.
     Параметры:
-        список таблиц класса SpanTable
+        список (или генератор) таблиц класса SpanTable
     Возвращает:
-        записывает в файл output_excel_path
+        записывает в файл output_excel_path, если есть хотя бы одна таблица
     """
 
-    if not(tables_span):
-        return
     wb = Workbook()
 
     # Удаляем дефолтную пустую страницу, чтобы потом создавать по одной на каждый table
@@ -282,55 +1311,59 @@ def write_to_excel(output_excel_path, tables_span):
         ws = wb.create_sheet(title=sheet_name)
 
 
-        # Матрица для хранения инфо о занятых ячейках
-        occupied = {}
-
-        current_row = 1
-        for row in table_span.get_table():
-            if len(row) == 0:
-                continue
-            # Получаем все столбцы (теги td и th) в строке
-            current_col = 1
-            for cell in row:
-                # Пропускаем уже занятые ячейки
-                while (current_row, current_col) in occupied:
-                    current_col += 1
-
-                rowspan = cell['rowspan']
-                colspan = cell['colspan']
+        # Позиции ячеек берём из сетки таблицы, раскладка уже выполнена
+        cells = table_span.cells
+        positions = table_span.positions
+        for index, cell in enumerate(cells):
+            current_row = positions[index][0] + 1
+            current_col = positions[index][1] + 1
 
-                # Мёржим ячейки, если указан rowspan/colspan
-                if rowspan > 1 or colspan > 1:
-                    start_row = current_row
-                    start_col = current_col
-                    end_row = current_row + rowspan - 1
-                    end_col = current_col + colspan - 1
-                    ws.merge_cells(
-                        start_row=start_row,
-                        start_column=start_col,
-                        end_row=end_row,
-                        end_column=end_col
-                    )
+            rowspan = cell.rowspan
+            colspan = cell.colspan
 
-                    # Помечаем все объединённые ячейки как занятые
-                    for r in range(start_row, end_row + 1):
-                        for c in range(start_col, end_col + 1):
-                            occupied[(r, c)] = True
+            # Мёржим ячейки, если указан rowspan/colspan
+            if rowspan > 1 or colspan > 1:
+                ws.merge_cells(
+                    start_row=current_row,
+                    start_column=current_col,
+                    end_row=current_row + rowspan - 1,
+                    end_column=current_col + colspan - 1
+                )
 
-                value = cell['value'].get_text(strip=True)
-                ws.cell(row=current_row, column=current_col, value=value)
-
-                current_col += 1
-
-            current_row += 1
+            ws.cell(row=current_row, column=current_col, value=cell.value)
 
+    if not wb.worksheets:
+        return
     wb.save(output_excel_path)
 
-def get_tables(html_path, format_table):
+def make_soup(markup, parser=DEFAULT_PARSER, only_tables=False, with_frames=False, with_links=False):
+    """
+    Разбор html выбранным парсером из PARSERS.
+    only_tables - строить дерево только из <table> (с вложенным содержимым),
+    остальная страница пропускается. html5lib так не умеет и строит всё дерево.
+    with_frames - вместе с таблицами оставить iframe и frame
+    with_links - вместе с таблицами оставить ссылки <a> (для обхода сайта)
+    """
+
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown parser {parser}, expected one of {PARSERS}")
+    if only_tables and parser != "html5lib":
+        names = ["table"]
+        if with_frames:
+            names += ["iframe", "frame"]
+        if with_links:
+            names += ["a"]
+        return BeautifulSoup(markup, parser, parse_only=SoupStrainer(names))
+    return BeautifulSoup(markup, parser)
+
+def get_tables(html_path, format_table, parser=DEFAULT_PARSER, candidates=False):
     """
     Функция даёт все таблицы.
     Параметры:
         путь к фалу и тип извлечения
+        parser - парсер html (см. PARSERS)
+        candidates - кроме <table> искать таблицы ARIA и элементы с table в class/id
+        (см. find_candidate_tables); для этого строится всё дерево страницы
     Возвращает:
         извлекает все таблицы по данному пути
     """
@@ -341,57 +1374,466 @@ def get_tables(html_path, format_table):
             sys.exit(1)
 
         with open(html_path, "r", encoding="utf-8") as f:
-            soup = BeautifulSoup(f, "html.parser")
+            soup = make_soup(f, parser, not candidates)
 
     elif format_table == "url":
         f = download_html(html_path)
-        soup = BeautifulSoup(f, "html.parser")
+        soup = make_soup(f, parser, not candidates)
     else:
         print("входные данные не коректны")
         sys.exit(1)
-    tables = soup.find_all("table", recursive=True)
+    return get_soup_tables(soup, candidates)
+
+def get_soup_tables(soup, candidates=False):
+    """Таблицы уже разобранной страницы, candidates как у get_tables"""
+
+    if candidates:
+        return find_candidate_tables(soup)
+    return soup.find_all("table", recursive=True)
+
+def get_frame_urls(soup, base_url):
+    """Абсолютные (относительно base_url) адреса http(s) iframe и frame страницы без повторов"""
+
+    urls = []
+    for frame in soup.find_all(["iframe", "frame"]):
+        src = frame.get("src")
+        if not src:
+            continue
+        url = urlparse(urljoin(base_url, src))._replace(fragment="").geturl()
+        if urlparse(url).scheme in ("http", "https") and url not in urls:
+            urls.append(url)
+    return urls
+
+def get_frame_tables(urls, frames, parser=DEFAULT_PARSER, candidates=False, engine='auto'):
+    """
+    Подлинные таблицы фреймов с адресами urls (см. get_frame_urls), список SpanTable.
+    Новые фреймы загружаются одновременно (FRAME_WORKERS потоков) и проверяются get_genuine_tables.
+    В словарь frames по url кладутся уже проверенные SpanTable, а не элементы bs4,
+    поэтому дерево фрейма не держится в памяти, а фрейм, встроенный во многие страницы,
+    загружается и проверяется один раз. Фреймы внутри фреймов не обходятся.
+    """
+
+    new_urls = [url for url in urls if url not in frames]
+    if new_urls:
+        with ThreadPoolExecutor(max_workers=FRAME_WORKERS) as pool:
+            for url, tables in zip(new_urls, pool.map(lambda url: fetch_frame_tables(url, parser, candidates), new_urls)):
+                print('\t', 'фрейм', url)
+                frames[url] = get_genuine_tables(tables, engine)
+
+    return [table for url in urls for table in frames[url]]
+
+def fetch_frame_tables(url, parser=DEFAULT_PARSER, candidates=False):
+    """Загрузка фрейма и его таблицы; недоступный фрейм даёт пустой список"""
+
+    try:
+        markup = download_html(url)
+    except requests.RequestException as e:
+        print(f"Фрейм {url} не загружен: {e}")
+        return []
+    soup = make_soup(markup, parser, only_tables=not candidates)
+    if candidates:
+        return find_candidate_tables(soup)
+    return soup.find_all("table", recursive=True)
+
+def find_candidate_tables(soup):
+    """
+    Все элементы, которые могут быть таблицами, за один обход дерева:
+    <table>, элементы с ролью ARIA из TABLE_ROLES и элементы с table в class или id.
+    Подсказка в class/id не учитывается у частей таблицы (TABLE_PARTS) и у элементов
+    внутри уже найденного кандидата: их строки - строки этого кандидата,
+    и таблица иначе была бы проверена и записана дважды.
+    Возвращает:
+        список элементов в порядке документа без повторов;
+        обёртки без собственных ячеек потом отсеиваются в get_reject_reason
+    """
+
+    tables = []
+    found = set()
+    for element in soup.find_all(True):
+        if element.name == "table" or element.get("role") in TABLE_ROLES:
+            tables.append(element)
+            found.add(id(element))
+            continue
+        if element.name in TABLE_PARTS:
+            continue
+        hint = " ".join(element.get("class", ())) + " " + element.get("id", "")
+        if TABLE_HINT.search(hint) and not any(id(parent) in found for parent in element.parents):
+            tables.append(element)
+            found.add(id(element))
     return tables
 
+def iter_tables(chunks, parser=DEFAULT_PARSER, offsets=None, data=None):
+    """
+    Потоковое извлечение таблиц.
+    Параметры:
+        chunks - куски html (str) по порядку, parser - парсер html (см. PARSERS)
+        offsets - список, в который добавляются (байт начала, байт конца)
+        каждой таблицы верхнего уровня; нужен data - исходные байты кусков (см. TableStream)
+    Возвращает:
+        генератор таблиц как у get_tables; таблица верхнего уровня и вложенные в неё
+        отдаются сразу после её </table>, в памяти держится только одна таблица
+    """
+
+    stream = TableStream(data)
+
+    def pop_tables():
+        for markup, start, end in stream.pop_ready():
+            if offsets is not None:
+                offsets.append((start, end))
+            yield from make_soup(markup, parser, only_tables=True).find_all("table")
+
+    for chunk in chunks:
+        stream.feed(chunk)
+        yield from pop_tables()
+    stream.close()
+    yield from pop_tables()
+
+def stream_tables(html_path, parser=DEFAULT_PARSER, chunk_size=1 << 20, offsets=None):
+    """
+    Потоковое извлечение таблиц из файла.
+    Файл отображается в память (mmap) и декодируется кусками по chunk_size байт,
+    поэтому целиком в строку Python не загружается даже очень большой файл.
+    Параметры:
+        offsets - список, в который добавляются байтовые (начало, конец)
+        каждой таблицы верхнего уровня для extract_table
+    Возвращает:
+        генератор таблиц (см. iter_tables)
+    """
+
+    if not os.path.isfile(html_path):
+        print(f"Файл {html_path} не найден.")
+        sys.exit(1)
+    if os.path.getsize(html_path) == 0:
+        return
+
+    with open(html_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        chunks = (decoder.decode(data[i:i + chunk_size], final=i + chunk_size >= len(data))
+                  for i in range(0, len(data), chunk_size))
+        yield from iter_tables(chunks, parser, offsets, data)
+
+def extract_table(html_path, start, end, parser=DEFAULT_PARSER):
+    """
+    Повторное извлечение таблицы по байтовым смещениям из stream_tables без разбора всего файла.
+    Возвращает:
+        таблицу верхнего уровня и вложенные в неё, как у get_tables
+    """
+
+    with open(html_path, "rb") as f:
+        f.seek(start)
+        markup = f.read(end - start).decode("utf-8")
+    return make_soup(markup, parser, only_tables=True).find_all("table")
+
+def make_session(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, pool_block=POOL_BLOCK):
+    """
+    Сессия requests с пулом keep-alive соединений.
+    Повторов в самой сессии нет, их делает get_response вместе с учётом ошибок хоста.
+    Параметры:
+        pool_connections - для скольких хостов держать пулы
+        pool_maxsize - сколько соединений держать на один хост
+        pool_block - не открывать к хосту больше pool_maxsize соединений одновременно,
+        а ждать, пока освободится одно из них
+    """
+
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def get_session():
+    """Общая сессия всех загрузок программы, создаётся при первом обращении"""
+
+    global http_session
+    if http_session is None:
+        http_session = make_session()
+    return http_session
+
+def set_session(session):
+    """Задать общую сессию, например make_session с другими размерами пула"""
+
+    global http_session
+    http_session = session
+
+def get_guard():
+    """Общий FetchGuard всех загрузок, создаётся при первом обращении"""
+
+    global fetch_guard
+    if fetch_guard is None:
+        fetch_guard = FetchGuard()
+    return fetch_guard
+
+def set_guard(guard):
+    """Задать общий FetchGuard, например с другим порогом отключения"""
+
+    global fetch_guard
+    fetch_guard = guard
+
+def get_cache():
+    """Общий кэш ответов или None"""
+
+    return response_cache
+
+def set_cache(cache):
+    """Задать общий кэш ответов (ResponseCache) или отключить его (None)"""
+
+    global response_cache
+    response_cache = cache
+
+def fetch_html(url, **kwargs):
+    """
+    Загрузка страницы через общую сессию и кэш ответов.
+    Если страница есть в кэше, запрос условный (If-None-Match / If-Modified-Since),
+    и при ответе 304 тело берётся из кэша, а Page.changed = False: тогда результаты
+    прошлого разбора этого тела можно взять из кэша (load_page_extra), не разбирая его.
+    kwargs передаются в get_response.
+    Возвращает:
+        Page
+    """
+
+    cache = get_cache()
+    entry = cache.get(url) if cache is not None else None
+    headers = {}
+    if entry is not None:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    response, body = get_response(url, headers, **kwargs)
+    if response.status_code == 304 and entry is not None:
+        cached = cache.read(entry)
+        if cached is not None:
+            return Page(url, 200, cached, entry["encoding"], changed=False, digest=entry["hash"])
+        # Тело пропало из кэша - запрашиваем заново без условий
+        response, body = get_response(url, **kwargs)
+
+    encoding = get_body_encoding(response, body)
+    digest = None
+    if cache is not None and response.status_code == 200:
+        digest = cache.put(url, body, encoding, response.headers)
+    return Page(url, response.status_code, body, encoding, digest=digest)
+
+def load_page_extra(page, name):
+    """
+    Результат разбора name, сохранённый save_page_extra, если страница не изменилась
+    с прошлого запуска (ответ 304), иначе None
+    """
+
+    cache = get_cache()
+    if cache is None or page.changed or page.digest is None:
+        return None
+    return cache.get_extra(page.digest, name)
+
+def save_page_extra(page, name, data):
+    """Сохранить в кэше ответов результат разбора страницы (данные для JSON) рядом с её телом"""
+
+    cache = get_cache()
+    if cache is not None and page.digest is not None:
+        cache.put_extra(page.digest, name, data)
+
+def get_response(url, headers=None, **kwargs):
+    """
+    Запрос через общую сессию с предельным временем, повторами и учётом ошибок хоста (get_guard).
+    При ошибке соединения, таймауте или ответе из RETRY_STATUSES запрос повторяется
+    до MAX_RETRIES раз со случайной паузой (см. get_backoff); каждая неудача
+    засчитывается хосту, и отключённый хост сразу даёт HostUnavailable.
+    Остальные ошибки (сертификат, TooManyRedirects, InvalidURL ...) повтором не исправить:
+    они не повторяются и не засчитываются хосту как неудача, но каждый допущенный
+    guard.allow запрос заканчивается guard.record, так что пробный запрос не зависает.
+    kwargs передаются в Session.get, timeout по умолчанию (CONNECT_TIMEOUT, READ_TIMEOUT),
+    verify по умолчанию VERIFY_SSL (в запросе, а не в сессии: Session.verify перекрывается
+    переменными окружения REQUESTS_CA_BUNDLE/CURL_CA_BUNDLE).
+    Возвращает:
+        (response, тело ответа); если повторы не помогли, ответ с кодом ошибки и пустым телом
+    Исключения:
+        requests.RequestException последней попытки, HostUnavailable, SkippedDownload
+    """
+
+    guard = get_guard()
+    host = urlparse(url).netloc
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    kwargs.setdefault("verify", VERIFY_SSL)
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(get_backoff(attempt - 1))
+        if not guard.allow(host):
+            raise HostUnavailable(f"хост {host} отключён после ошибок подряд: {url}")
+
+        start = time.monotonic()
+        try:
+            response = get_session().get(url, headers=headers, stream=True, **kwargs)
+            if response.status_code in RETRY_STATUSES:
+                response.close()
+                guard.record(host, time.monotonic() - start, f"ответ {response.status_code}")
+                result = (response, b"")
+                continue
+            body = read_body(response, deadline=start + FETCH_DEADLINE)
+        except SkippedDownload:
+            guard.record(host, time.monotonic() - start)
+            raise
+        except requests.exceptions.SSLError as e:
+            # SSLError - это и ConnectionError, но повтор сертификат не исправит
+            guard.record(host, time.monotonic() - start, type(e).__name__, failure=False)
+            raise
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            guard.record(host, time.monotonic() - start, type(e).__name__)
+            result = e
+            continue
+        except Exception as e:
+            guard.record(host, time.monotonic() - start, type(e).__name__, failure=False)
+            raise
+        guard.record(host, time.monotonic() - start)
+        return response, body
+
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+def get_backoff(attempt):
+    """Пауза перед повтором: случайная от 0 до RETRY_BACKOFF * 2 ** attempt, не больше RETRY_BACKOFF_MAX"""
+
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+
+def read_body(response, max_bytes=MAX_BODY_BYTES, deadline=None):
+    """
+    Чтение тела ответа, открытого с stream=True.
+    Ответ, который по заголовкам не HTML (pdf, картинки, архивы) или длиннее max_bytes,
+    прерывается SkippedDownload без чтения тела. gzip/deflate (и br, если установлен brotli)
+    распаковываются urllib3 по ходу чтения, так что предел считается по распакованным байтам.
+    deadline - момент time.monotonic(), после которого чтение прерывается requests.Timeout,
+    чтобы медленно отдающий сервер не держал загрузку бесконечно.
+    Возвращает:
+        тело ответа (bytes)
+    """
+
+    with response:
+        if response.status_code == 200:
+            mime = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if mime and mime not in HTML_TYPES:
+                raise SkippedDownload(f"не HTML ({mime}): {response.url}")
+        length = response.headers.get("Content-Length", "")
+        # Content-Length - размер сжатого тела, распакованное не меньше
+        if length.isdigit() and int(length) > max_bytes:
+            raise SkippedDownload(f"больше {max_bytes} байт ({length}): {response.url}")
+
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(DOWNLOAD_CHUNK):
+            size += len(chunk)
+            if size > max_bytes:
+                raise SkippedDownload(f"больше {max_bytes} байт: {response.url}")
+            if deadline is not None and time.monotonic() > deadline:
+                raise requests.Timeout(f"ответ не получен за {FETCH_DEADLINE} с: {response.url}")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+def get_body_encoding(response, body):
+    """
+    Кодировка из charset заголовка Content-Type, иначе определённая по самому телу.
+    Неизвестный Python charset (text/html; charset=foo-bar) пропускается, как в response.text,
+    иначе декодирование страницы оборвало бы весь обход LookupError.
+    """
+
+    match = re.search(r"charset=[\"']?([\w.:-]+)", response.headers.get("Content-Type", ""), re.I)
+    if match:
+        try:
+            codecs.lookup(match.group(1))
+            return match.group(1)
+        except LookupError:
+            pass
+    return requests.compat.chardet.detect(body)["encoding"] or "utf-8"
+
 def download_html(url):
     """Получение html файла по url"""
-    response = requests.get(url, verify=False)
-    response.raise_for_status()  # Проверка успешности запроса
-    return response.content.decode("utf-8")
+    page = fetch_html(url)
+    if page.status >= 400:  # Проверка успешности запроса
+        raise requests.HTTPError(f"{page.status} for url: {url}")
+    return page.get_text()
 
-def get_genuine_tables(tables):
+def get_genuine_tables(tables, engine='auto'):
     """
     Функция получает список таблиц из фала и выдаёт только подлинные.
     Параметры:
         soup.find_all
         все таблицы, найденные в файле
+        engine - движок проверки подлинности (см. SpanTable)
     Возвращает:
         список SpanTable
         все подлинные таблицы в классе SpanTable
     """
 
-    genuine_tables = []
+    return list(iter_genuine_tables(tables, engine))
+
+def iter_genuine_tables(tables, engine='auto'):
+    """
+    То же, что get_genuine_tables, но генератором: каждая таблица проверяется,
+    как только её отдал источник (например, stream_tables), и сразу отдаётся дальше.
+    У каждой SpanTable задаются number (номер в tables с 1) и parent (номер таблицы,
+    в которую она вложена, или None), так что дерево вложенности известно и для
+    отсеянных родителей.
+    """
+
+    # Таблицы, отсеянные до проверки подлинности, по причинам
+    rejected = {}
+    # Цепочка открытых таблиц-предков (элемент, номер): таблицы идут в порядке документа,
+    # поэтому родитель вложенной таблицы всегда в этой цепочке
+    ancestors = []
     for i, table in enumerate(tables):
-        table_span = SpanTable()
-        table_span.make_table(table)
+        parent = table.find_parent("table")
+        while ancestors and ancestors[-1][0] is not parent:
+            ancestors.pop()
+        table_span = SpanTable(engine)
+        table_span.number = i + 1
+        table_span.parent = ancestors[-1][1] if ancestors else None
+        ancestors.append((table, i + 1))
+        reason = table_span.get_reject_reason(table)
+        if reason is None:
+            try:
+                table_span.make_table(table)
+            except ValueError:
+                reason = "некорректный rowspan/colspan"
+        if reason is not None:
+            rejected[reason] = rejected.get(reason, 0) + 1
+            print('\t',i + 1, 'not', f'({reason})')
+            continue
+
         type_of_genuine = table_span.get_type_of_genuine()
         print('\t',i + 1, type_of_genuine)
 
         if type_of_genuine != 'not':
-            genuine_tables += [table_span]
-    return genuine_tables
+            yield table_span
 
-def crawl_in_depth(start_url, max_depth=2):
+    if rejected:
+        print('\t', 'отсеяно без проверки:', sum(rejected.values()), rejected)
+
+def crawl_in_depth(start_url, max_depth=2, parser=DEFAULT_PARSER, on_page=None, link_filter=None, candidates=False):
     """
     Функция выполняет рекурсивный (в глубину) обход ссылок.
+    Страницы загружаются по одной, без ограничения частоты и паузы между запросами:
+    вежливость к хосту (HostScheduler) есть только у crawl_concurrent.
     Параметры:
       start_url: стартовый URL для обхода
       max_depth: максимальная глубина обхода
+      parser: парсер html (см. PARSERS)
+      on_page: функция (url, soup, page), вызывается для каждой загруженной страницы;
+        soup содержит ссылки, таблицы и фреймы страницы (make_soup с only_tables),
+        так что таблицы извлекаются без повторной загрузки и разбора, page - её Page.
+        Страница, не изменившаяся с прошлого запуска (304), чьи ссылки есть в кэше ответов,
+        не разбирается: soup = None, и результаты прошлого разбора берутся по page
+        из кэша (load_page_extra), а если их нет - страница разбирается из page.get_text()
+      link_filter: LinkFilter, ссылки которого отбрасываются без загрузки;
+        по умолчанию LinkFilter() - только схемы и расширения
+      candidates: строить всё дерево страницы, чтобы on_page мог искать
+        кандидаты в таблицы (см. find_candidate_tables), а не только <table>
     Возвращает:
       Множество уникальных ссылок (str) из указанного домена
     """
 
     visited = set()
     domain = urlparse(start_url).netloc
+    if link_filter is None:
+        link_filter = LinkFilter()
 
     def dfs(url, depth):
         if depth == 0:
@@ -400,46 +1842,169 @@ def crawl_in_depth(start_url, max_depth=2):
             return
         visited.add(url)
 
-        try:
-            response = requests.get(url, timeout=5)
-            soup = BeautifulSoup(response.text, 'html.parser')
-        except Exception:
+        result = fetch_page(url, parser, candidates)
+        if result is None:
             return
+        page, soup, hrefs = result
 
-        # Извлечение всех ссылок <a href="...">
-        for link in soup.find_all('a'):
-            href = link.get('href')
-            if not href:
-                continue
+        if on_page is not None:
+            on_page(url, soup, page)
+
+        # Страница и её дерево дальше не нужны, рекурсия идёт по готовому списку ссылок
+        links = get_page_links(url, hrefs, domain, link_filter)
+        result = page = soup = None
+        for link in links:
+            dfs(link, depth - 1)
+
+    dfs(start_url, max_depth)
+    return visited
 
-            # Приведение ссылки к абсолютному адресу
-            absolute_url = urljoin(url, href)
+def crawl_concurrent(start_url, max_depth=2, parser=DEFAULT_PARSER, on_page=None, concurrency=CRAWL_CONCURRENCY,
+                     scheduler=None, link_filter=None, candidates=False):
+    """
+    Параллельный обход ссылок на asyncio, параметры как у crawl_in_depth.
+    concurrency - сколько страниц загружается одновременно
+    (больше POOL_MAXSIZE не имеет смысла: лишние загрузки ждут свободного соединения пула).
+    scheduler - HostScheduler с ограничениями на хост, по умолчанию с настройками HOST_*;
+    его статистика печатается в конце обхода. Одновременных запросов к хосту не больше
+    меньшего из concurrency и max_in_flight планировщика (по умолчанию предела на хост нет,
+    и действует concurrency), а частота запросов ограничена его rate: при HOST_RATE
+    запросов в секунду большее concurrency обход не ускорит.
+    Обход идёт по уровням: страница получает глубину по кратчайшему пути от start_url,
+    поэтому результат не зависит от того, какая загрузка закончилась раньше.
+    on_page вызывается в отдельном потоке (asyncio.to_thread), чтобы загрузки продолжались,
+    пока страница обрабатывается, поэтому on_page должна быть потокобезопасной.
+    Возвращает:
+      Множество уникальных ссылок (str) из указанного домена
+    """
 
-            # Нормализация URL (убираем query-параметры и фрагменты)
-            parsed = urlparse(absolute_url)
-            normalized_url = parsed._replace(query="", fragment="").geturl()
-            absolute_url = normalized_url
-            #absolute_url = absolute_url.split('#')[0]
+    if scheduler is None:
+        scheduler = HostScheduler()
+    visited = asyncio.run(crawl_async(start_url, max_depth, parser, on_page, concurrency, scheduler, link_filter,
+                                      candidates))
+    scheduler.print_report()
+    return visited
 
-            # Проверяем, что ссылка ведет на тот же домен
-            if urlparse(absolute_url).netloc == domain:
-                dfs(absolute_url, depth - 1)
+async def crawl_async(start_url, max_depth=2, parser=DEFAULT_PARSER, on_page=None, concurrency=CRAWL_CONCURRENCY,
+                      scheduler=None, link_filter=None, candidates=False):
+    """Сопрограмма обхода для crawl_concurrent"""
 
-    dfs(start_url, max_depth)
+    visited = {start_url} if max_depth > 0 else set()
+    domain = urlparse(start_url).netloc
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    # Свой пул потоков загрузок: пул asyncio.to_thread по умолчанию - cpu_count() + 4 потока,
+    # и на машине с малым числом ядер он ограничивал бы concurrency
+    fetch_pool = ThreadPoolExecutor(max_workers=concurrency)
+    if scheduler is None:
+        scheduler = HostScheduler()
+    if link_filter is None:
+        link_filter = LinkFilter()
+
+    async def visit(url):
+        # Общее место занимается, только когда хост готов: придержанный хост не занимает место других
+        host = await scheduler.acquire(url, semaphore)
+        try:
+            # Загрузка и разбор идут в потоке, чтобы не останавливать цикл событий
+            result = await loop.run_in_executor(fetch_pool, fetch_page, url, parser, candidates)
+        finally:
+            scheduler.release(host, semaphore)
+        if result is None:
+            return []
+        page, soup, hrefs = result
+        links = get_page_links(url, hrefs, domain, link_filter)
+        if on_page is not None:
+            # Извлечение таблиц, фреймы и запись xlsx не должны останавливать цикл событий
+            await asyncio.to_thread(on_page, url, soup, page)
+        return links
+
+    level = list(visited)
+    with fetch_pool:
+        for depth in range(max_depth, 0, -1):
+            next_level = []
+            for links in await asyncio.gather(*(visit(url) for url in level)):
+                if depth == 1:
+                    continue
+                for link in links:
+                    if link not in visited:
+                        visited.add(link)
+                        next_level.append(link)
+            level = next_level
     return visited
 
+def fetch_page(url, parser=DEFAULT_PARSER, candidates=False):
+    """
+    Загрузка страницы для обхода.
+    candidates - разобрать всё дерево страницы, а не только таблицы, фреймы и ссылки
+    Возвращает:
+      (Page, soup со ссылками, таблицами и фреймами страницы, адреса href ссылок <a>)
+      или None, если страница недоступна. Если страница не изменилась с прошлого запуска
+      (304) и её ссылки сохранены в кэше ответов, она не разбирается и soup = None
+    """
+
+    try:
+        page = fetch_html(url)
+    except requests.RequestException as e:
+        print(f"Страница {url} не загружена: {e}")
+        return None
+    if page.status >= 400:
+        print(f"Страница {url} не загружена: ответ {page.status}")
+        return None
+    name = "links-" + parser
+    hrefs = load_page_extra(page, name)
+    if hrefs is not None:
+        return page, None, hrefs
+    soup = make_soup(page.get_text(), parser, only_tables=not candidates, with_frames=True, with_links=True)
+    hrefs = [link.get('href') for link in soup.find_all('a')]
+    save_page_extra(page, name, hrefs)
+    return page, soup, hrefs
+
+def get_page_links(url, hrefs, domain, link_filter=None):
+    """
+    Абсолютные ссылки страницы url из адресов href её ссылок <a>, ведущие на domain,
+    без query и фрагментов.
+    link_filter - LinkFilter, отброшенные им ссылки не возвращаются
+    """
+
+    links = []
+    for href in hrefs:
+        if not href:
+            continue
+        if link_filter is not None and link_filter.skip_href(href):
+            continue
+
+        # Приведение ссылки к абсолютному адресу
+        absolute_url = urljoin(url, href)
+
+        # Нормализация URL (убираем query-параметры и фрагменты)
+        parsed = urlparse(absolute_url)
+        normalized_url = parsed._replace(query="", fragment="").geturl()
+        absolute_url = normalized_url
+        #absolute_url = absolute_url.split('#')[0]
+
+        # Проверяем, что ссылка ведет на тот же домен
+        if parsed.netloc != domain:
+            continue
+        if link_filter is None or link_filter.accept(absolute_url):
+            links.append(absolute_url)
+    return links
+
 def arg_parser(args):
     """
     Функция получает входные параметры для работы программы
     (формат задаваемой таблицы, расположение, и выходные файл).
     Параметры:
         sys.argv
-        python script.py url/file путь_к_html путь_к_xlsx"
+        python script.py url/file путь_к_html путь_к_xlsx глубина парсер потоки включить исключить"
+        включить/исключить - шаблоны ссылок обхода через пробел (см. LinkFilter)
+        ключ -candidates в любом месте - искать и таблицы без <table> (см. find_candidate_tables)
     Возвращает:
         Map
         (формат задаваемой таблицы, расположение, и выходные файл)
     """
 
+    candidates = "-candidates" in args
+    args = [arg for arg in args if arg != "-candidates"]
     if len(args) < 2:
         raise ArgumentError("Incorrect number of arguments")
     else:
@@ -453,11 +2018,21 @@ def arg_parser(args):
         else:
             raise ArgumentError("Invalid type of source")
         html_path = args[2]
-        result = {"format_table": format_table, "html_path": html_path}
+        result = {"format_table": format_table, "html_path": html_path, "candidates": candidates}
         if len(args) > 3:
             result.update({"xlsx_path": args[3]})
         if len(args) > 4:
-            result.update({"max_depth": args[4]})
+            result.update({"max_depth": int(args[4])})
+        if len(args) > 5:
+            if args[5] not in PARSERS:
+                raise ArgumentError("Invalid parser")
+            result.update({"parser": args[5]})
+        if len(args) > 6:
+            result.update({"concurrency": int(args[6])})
+        if len(args) > 7:
+            result.update({"include": tuple(args[7].split())})
+        if len(args) > 8:
+            result.update({"exclude": tuple(args[8].split())})
     return result
 
 def data_acquisition():
@@ -465,7 +2040,7 @@ def data_acquisition():
     Функция получает входные параметры и если их нет то задаёт значение по умолчанию
     (формат задаваемой таблицы, расположение, и выходные файл).
     Параметры:
-        python script.py url/file путь_к_html путь_к_xlsx"
+        python script.py url/file путь_к_html путь_к_xlsx глубина парсер потоки включить исключить"
     Возвращает:
         Map
         (формат задаваемой таблицы, расположение, и выходные файл, таблицы в айле)
@@ -475,10 +2050,16 @@ def data_acquisition():
     html_path = 'https://docs.python.org/3/library/urllib.parse.html'  # sys.argv[2]
     xlsx_path = 'example.xlsx'  # sys.argv[3]
     max_depth = 2 # sys.argv[4]
-    args_count = len(sys.argv)
-
-    if args_count == 2 or args_count > 5:
-        print("Использование: python script.py url/file путь_к_html путь_к_xlsx")
+    parser = DEFAULT_PARSER # sys.argv[5]
+    concurrency = 1 # sys.argv[6], больше 1 - параллельный обход crawl_concurrent
+    include = () # sys.argv[7]
+    exclude = () # sys.argv[8]
+    candidates = False # ключ -candidates
+    args_count = len([arg for arg in sys.argv if arg != "-candidates"])
+
+    if args_count == 2 or args_count > 9:
+        print("Использование: python script.py url/file путь_к_html путь_к_xlsx глубина парсер потоки "
+              "включить исключить [-candidates]")
         raise ArgumentError("Incorrect arguments")
         # sys.exit(1)
 
@@ -487,19 +2068,89 @@ def data_acquisition():
         a = arg_parser(sys.argv)
         format_table = a["format_table"]
         html_path = a["html_path"]
-        max_depth = a["max_depth"]
+        candidates = a["candidates"]
+        if "max_depth" in a.keys():
+            max_depth = a["max_depth"]
         if "xlsx_path" in a.keys():
             xlsx_path = a["xlsx_path"]
-
-    return {'html_path': html_path, 'xlsx_path': xlsx_path, 'format_table': format_table, 'max_depth': max_depth}
+        if "parser" in a.keys():
+            parser = a["parser"]
+        if "concurrency" in a.keys():
+            concurrency = a["concurrency"]
+        if "include" in a.keys():
+            include = a["include"]
+        if "exclude" in a.keys():
+            exclude = a["exclude"]
+
+    return {'html_path': html_path, 'xlsx_path': xlsx_path, 'format_table': format_table, 'max_depth': max_depth,
+            'parser': parser, 'concurrency': concurrency, 'include': include, 'exclude': exclude,
+            'candidates': candidates}
 
 if __name__ == "__main__":
     data = data_acquisition()
-    html_paths = crawl_in_depth(data['html_path'], data["max_depth"])
-    for i, html_path in enumerate(html_paths):
-        print(i + 1, html_path)
-        all_tables = get_tables(html_path, data['format_table'])
-        genuine_tables = get_genuine_tables(all_tables)
-        name_xlsx = data['xlsx_path'][:-4] + str(i + 1) + '.xlsx'
-        write_to_excel(name_xlsx, genuine_tables)
-        #os.startfile(name_xlsx)
+    # Подлинные таблицы фреймов по url: общий фрейм многих страниц загружается и проверяется один раз за запуск
+    frames = {}
+    pages = []
+    # crawl_concurrent вызывает extract_page из потоков: страницы обрабатываются по одной,
+    # чтобы номера файлов, кэш фреймов и печать разных страниц не перемешивались
+    page_lock = threading.Lock()
+    link_filter = LinkFilter(data['include'], data['exclude'])
+
+    def extract_page(html_path, soup, page):
+        """
+        Таблицы страницы, которую обходчик уже загрузил и разобрал.
+        Подлинные таблицы и адреса фреймов сохраняются в кэше ответов рядом с телом страницы:
+        если в следующий раз сервер ответит 304, они берутся оттуда без разбора и проверки.
+        """
+
+        name = f"tables-{data['parser']}-{'candidates' if data['candidates'] else 'tables'}"
+        with page_lock:
+            pages.append(html_path)
+            print(len(pages), html_path)
+            extra = load_page_extra(page, name)
+            if extra is not None:
+                genuine_tables = []
+                for table_data in extra["tables"]:
+                    table_span = SpanTable()
+                    table_span.set_data(table_data)
+                    genuine_tables.append(table_span)
+                frame_urls = extra["frames"]
+                print('\t', 'без изменений, подлинных таблиц из кэша:', len(genuine_tables))
+            else:
+                if soup is None:
+                    # Ссылки были в кэше, а таблицы нет (например, прошлый запуск прервался)
+                    soup = make_soup(page.get_text(), data['parser'], only_tables=not data['candidates'],
+                                     with_frames=True)
+                # Дерево страницы не сохраняем: SpanTable хранит только текст и структуру ячеек
+                genuine_tables = get_genuine_tables(get_soup_tables(soup, data['candidates']))
+                frame_urls = get_frame_urls(soup, html_path)
+                save_page_extra(page, name, {"tables": [table_span.get_data() for table_span in genuine_tables],
+                                             "frames": frame_urls})
+            genuine_tables += get_frame_tables(frame_urls, frames, data['parser'], data['candidates'])
+            name_xlsx = data['xlsx_path'][:-4] + str(len(pages)) + '.xlsx'
+            write_to_excel(name_xlsx, genuine_tables)
+            #os.startfile(name_xlsx)
+
+    if data['format_table'] == 'file':
+        print(1, data['html_path'])
+        if data['candidates']:
+            # Кандидатам без <table> нужно всё дерево страницы, потоком их не найти
+            genuine_tables = iter_genuine_tables(get_tables(data['html_path'], 'file', data['parser'], True))
+        else:
+            # Файл разбирается потоком: таблицы проверяются и пишутся по мере чтения
+            genuine_tables = iter_genuine_tables(stream_tables(data['html_path'], data['parser']))
+        write_to_excel(data['xlsx_path'][:-4] + '1.xlsx', genuine_tables)
+    else:
+        set_cache(ResponseCache())
+        try:
+            if data['concurrency'] > 1:
+                crawl_concurrent(data['html_path'], data["max_depth"], data['parser'], extract_page,
+                                 data['concurrency'], link_filter=link_filter, candidates=data['candidates'])
+            else:
+                crawl_in_depth(data['html_path'], data["max_depth"], data['parser'], on_page=extract_page,
+                               link_filter=link_filter, candidates=data['candidates'])
+        finally:
+            # Индекс кэша сохраняется и при ошибке или Ctrl+C, чтобы тела в objects/ не потерялись
+            get_cache().save()
+        link_filter.print_report()
+        get_guard().print_report()